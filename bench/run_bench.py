@@ -0,0 +1,200 @@
+#!/usr/bin/env python
+#coding: utf-8
+
+import os, sys, time, math, random, bisect, shutil, tempfile, platform, argparse, json
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+from chirp import options_parser, external_sort, benchmark, rr_benchmark, dataset_stats
+from chirp.ts_circular_buffer import TSCircularBuffer
+from chirp.ts_alias_buffer import TSAliasBuffer
+from chirp.record_fields import field_extractor
+import synthetic_tweets
+
+
+# Benchmark suite for Chirp's own hot paths. Generates synthetic corpora of several sizes and times sorting, both
+# benchmark generators and the read buffer, then writes the results as JSON, so that runs of different releases on the
+# same machine can be compared. With -c, it first checks that sharded generation draws reads like unsharded generation.
+
+def timed(function, *args):
+    start = time.time()
+    function(*args)
+    return time.time() - start
+
+def result(name, size, seconds, records):
+    return {'name': name,
+            'size': size,
+            'seconds': seconds,
+            'records_per_second': records / seconds if seconds else None}
+
+def bench_pipeline(size, work_dir, args):
+    corpus = os.path.join(work_dir, 'corpus.%d.json' % size)
+    sorted_file = os.path.join(work_dir, 'sorted.%d.dat' % size)
+    output_file = os.path.join(work_dir, 'benchmark.%d.file' % size)
+    with open(corpus, 'w', 1024*1024) as w:
+        synthetic_tweets.generate(w, size, args.rate, args.users, args.skew, args.jitter, args.seed)
+
+    results = []
+    process_parameters, benchmark_parameters, file_parameters = options_parser.parse_args(
+        ['-i', corpus, '-s', sorted_file, '-t', work_dir] + args.chirp_args)
+    results.append(result('batch_sort', size, timed(external_sort.batch_sort, process_parameters, file_parameters), size))
+
+    # Generation reads the sorted file, along with the statistics sidecar batch_sort left next to it
+    for name, generator, extra_args in (('generate_benchmark', benchmark, []),
+                                        ('rr_generate_benchmark', rr_benchmark, ['-rrw', '10'])):
+        process_parameters, benchmark_parameters, file_parameters = options_parser.parse_args(
+            ['-i', sorted_file, '-p', '-o', output_file, '--seed', str(args.seed)] + extra_args + args.chirp_args)
+        seconds = timed(generator.generate_benchmark, process_parameters, benchmark_parameters, file_parameters)
+        with open(output_file) as r:
+            commands = sum(1 for line in r)
+        results.append(result(name, size, seconds, commands))
+
+    for name in (corpus, sorted_file, dataset_stats.sidecar_name(sorted_file), output_file):
+        os.remove(name)
+    return results
+
+def bench_read_buffer(ReadBuffer, size, operations, seed):
+    rng = random.Random(seed)
+    log_probs = [rng.random() for index in xrange(operations)]
+
+    read_buffer = ReadBuffer(size)
+    for index in xrange(size):
+        read_buffer.insert(index, 0.0)
+
+    start = time.time()
+    for index in xrange(operations):
+        read_buffer.insert(index, log_probs[index])
+    insert_seconds = time.time() - start
+
+    random.seed(seed)
+    start = time.time()
+    for index in xrange(operations):
+        read_buffer.rand()
+    rand_seconds = time.time() - start
+
+    return [result(ReadBuffer.__name__ + '.insert', size, insert_seconds, operations),
+            result(ReadBuffer.__name__ + '.rand', size, rand_seconds, operations)]
+
+# Sorted ages, in benchmark milliseconds, of the keys read by the primary key reads of a benchmark file
+def read_ages(benchmark_file, key_field):
+    extract_key = field_extractor([key_field])
+    written = dict()
+    ages = []
+    with open(benchmark_file) as r:
+        for line in r:
+            timestamp, command, value = line.rstrip('\n').split('\t', 2)
+            if command == 'w':
+                written[str(extract_key(value)[0])] = int(timestamp)
+            elif command == 'rp':
+                ages.append(int(timestamp) - written[value])
+    ages.sort()
+    return ages
+
+# Two-sample Kolmogorov-Smirnov statistic and its critical value at the 1% level
+def ks_test(a, b):
+    statistic = max(abs(bisect.bisect_right(a, value) / float(len(a)) - bisect.bisect_right(b, value) / float(len(b)))
+                    for value in set(a) | set(b))
+    return statistic, 1.63 * math.sqrt((len(a) + len(b)) / float(len(a) * len(b)))
+
+# Generates the same benchmark with and without shards, with a freshness that makes late shards start with large
+# log-likelihoods, and compares the ages of the keys read
+def check_sharding(size, work_dir, args):
+    corpus = os.path.join(work_dir, 'corpus.check.json')
+    sorted_file = os.path.join(work_dir, 'sorted.check.dat')
+    with open(corpus, 'w', 1024*1024) as w:
+        synthetic_tweets.generate(w, size, 50, args.users, args.skew, args.jitter, args.seed)
+    process_parameters, benchmark_parameters, file_parameters = options_parser.parse_args(['-i', corpus, '-s', sorted_file, '-t', work_dir])
+    external_sort.batch_sort(process_parameters, file_parameters)
+
+    ages = []
+    for shards in (1, 4):
+        output_file = os.path.join(work_dir, 'benchmark.check.%d.file' % shards)
+        process_parameters, benchmark_parameters, file_parameters = options_parser.parse_args(
+            ['-i', sorted_file, '-p', '-o', output_file, '--seed', str(args.seed), '-f', '0.1', '-rw', '1', '-sh', str(shards)])
+        benchmark.generate_benchmark(process_parameters, benchmark_parameters, file_parameters)
+        ages.append(read_ages(output_file, process_parameters.key_fields[0]))
+        os.remove(output_file)
+
+    for name in (corpus, sorted_file, dataset_stats.sidecar_name(sorted_file)):
+        os.remove(name)
+    statistic, critical = ks_test(*ages)
+    return {'name': 'sharded_read_ages', 'size': size, 'reads': map(len, ages), 'ks_statistic': statistic, 'ks_critical': critical}
+
+def parse_args(args=None):
+    parser = argparse.ArgumentParser(description='Chirp benchmark suite',
+                                     epilog='Arguments after -- are passed on to Chirp, e.g. -- -j 4 -bs 100000.')
+
+    help = 'Name and path of the JSON results file. Default value is \'bench_results.json\'.'
+    parser.add_argument('-o', action='store', dest='out_file', default='bench_results.json', help=help)
+
+    help = 'Corpus sizes, in tweets, to time sorting and generation at. Repeat flag for several sizes. Default value is [10000, 100000].'
+    parser.add_argument('-n', action='append', type=int, dest='sizes', default=[], help=help)
+
+    help = 'Read buffer sizes to time TSCircularBuffer and TSAliasBuffer at. Repeat flag for several sizes. Default value is [1000, 10000, 100000].'
+    parser.add_argument('-b', action='append', type=int, dest='buffer_sizes', default=[], help=help)
+
+    help = 'Number of inserts and random reads timed per read buffer size. Default value is 200,000.'
+    parser.add_argument('-ops', action='store', type=int, dest='operations', default=200000, help=help)
+
+    help = 'Average number of tweets per second in the synthetic corpus. Default value is 500.'
+    parser.add_argument('-r', action='store', type=float, dest='rate', default=500, help=help)
+
+    help = 'Number of distinct users in the synthetic corpus. Default value is 100,000.'
+    parser.add_argument('-u', action='store', type=int, dest='users', default=100000, help=help)
+
+    help = 'Zipf exponent of the user distribution in the synthetic corpus. Default value is 1.'
+    parser.add_argument('-z', action='store', type=float, dest='skew', default=1.0, help=help)
+
+    help = 'Maximum number of milliseconds timestamps lag behind the order of the records. Default value is 5000.'
+    parser.add_argument('-j', action='store', type=int, dest='jitter', default=5000, help=help)
+
+    help = 'Seed for the corpus and for Chirp. Default value is 0.'
+    parser.add_argument('--seed', action='store', type=int, dest='seed', default=0, help=help)
+
+    help = 'Check first that generation in 4 shards reads keys of the same ages as generation without shards, with freshness 0.1, on a corpus of this many tweets. Default value is 0, i.e. no check.'
+    parser.add_argument('-c', action='store', type=int, dest='check_size', default=0, help=help)
+
+    help = 'Directory for corpora and temporary files. Default value is a new temporary directory.'
+    parser.add_argument('-t', action='store', dest='work_dir', default=None, help=help)
+
+    if args is None:
+        args = sys.argv[1:]
+    chirp_args = []
+    if '--' in args:
+        args, chirp_args = args[:args.index('--')], args[args.index('--') + 1:]
+    args = parser.parse_args(args)
+    args.chirp_args = chirp_args
+    args.sizes = args.sizes or [10000, 100000]
+    args.buffer_sizes = args.buffer_sizes or [1000, 10000, 100000]
+    return args
+
+if __name__ == '__main__':
+    args = parse_args()
+    work_dir = args.work_dir or tempfile.mkdtemp(prefix='chirp-bench-')
+
+    results = []
+    checks = []
+    try:
+        if args.check_size:
+            checks.append(check_sharding(args.check_size, work_dir, args))
+            if checks[-1]['ks_statistic'] > checks[-1]['ks_critical']:
+                sys.exit('Sharded generation reads keys of other ages than unsharded generation: %r' % checks[-1])
+        for size in args.sizes:
+            results.extend(bench_pipeline(size, work_dir, args))
+        for size in args.buffer_sizes:
+            for ReadBuffer in (TSCircularBuffer, TSAliasBuffer):
+                results.extend(bench_read_buffer(ReadBuffer, size, args.operations, args.seed))
+    finally:
+        if args.work_dir is None:
+            shutil.rmtree(work_dir, ignore_errors=True)
+
+    for entry in results:
+        sys.stderr.write('%-24s %10d %10.3f s %14.0f /s\n' % (entry['name'], entry['size'], entry['seconds'], entry['records_per_second'] or 0))
+
+    report = {'timestamp': time.strftime('%Y-%m-%dT%H:%M:%S'),
+              'python': platform.python_version(),
+              'platform': platform.platform(),
+              'chirp_args': args.chirp_args,
+              'checks': checks,
+              'results': results}
+    with open(args.out_file, 'w') as w:
+        json.dump(report, w, indent=2, sort_keys=True)
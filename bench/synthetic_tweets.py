@@ -0,0 +1,106 @@
+#!/usr/bin/env python
+#coding: utf-8
+
+import sys, random, bisect, argparse
+
+
+# Synthetic tweet corpus generator. Records have the fields of the Twitter archives Chirp is usually run on, and arrive as
+# a Poisson process at a configurable rate. Users follow a Zipf distribution, so that a few users write most tweets.
+# Timestamps are jittered against the order of the records, as in real archives, so that the corpus needs sorting.
+
+TEMPLATE = ('{"RetweetsNum":null,"GeoLocation":null,"Hashtags":%s,"ReplyToId":%s,"CreationTime":%d,"IsFavorited":false,'
+            '"UserID":%d,"MediaLinks":null,"URLLinks":null,"Source":"%s","Place":null,'
+            '"Text":"Tweet text removed as per Twitter policy","IsRetweet":%s,"UserMentions":%s,"ID":%d}\n')
+SOURCES = ('web', '<a href=\\"http:\\/\\/twitter.com\\/download\\/android\\" rel=\\"nofollow\\">Twitter for Android<\\/a>',
+           '<a href=\\"http:\\/\\/twitter.com\\/download\\/iphone\\" rel=\\"nofollow\\">Twitter for iPhone<\\/a>')
+HASHTAGS = ('"news;"', '"music;"', '"jobs;tech;"', '"sports;"', '"love;"')
+
+# ID and creation time of the first synthetic tweet, taken from the sample in the example folder
+FIRST_ID = 370802584283406336
+FIRST_TIME = 1377241199000
+
+
+class ZipfSampler():
+    '''Samples ranks from 0 to n - 1 with probabilities proportional to 1/(rank + 1)**skew by binary search over the
+    cumulative weights. A skew of 0 gives uniform ranks.'''
+
+    def __init__(self, n, skew, rng):
+        '''Build the cumulative weights.'''
+
+        self._rng = rng
+        self._n = n
+        self._cumulative = None
+        if skew:
+            self._cumulative = []
+            total = 0.0
+            for rank in xrange(n):
+                total += (rank + 1) ** -skew
+                self._cumulative.append(total)
+
+
+    def sample(self):
+        '''Random rank.'''
+
+        if self._cumulative is None:
+            return int(self._rng.random() * self._n)
+        return bisect.bisect_left(self._cumulative, self._rng.random() * self._cumulative[-1])
+
+
+# Scatters user ranks over 32-bit user IDs. Multiplying by an odd constant modulo 2**32 is a bijection.
+def user_id(rank):
+    return (rank * 2654435761 + 1) & 0xffffffff
+
+def generate(output, records, rate, users, skew, jitter, seed):
+    rng = random.Random(seed)
+    sampler = ZipfSampler(users, skew, rng)
+    arrival = FIRST_TIME
+    tweet_id = FIRST_ID
+    write = output.write
+    for index in xrange(records):
+        arrival += rng.expovariate(rate / 1000.0)
+        tweet_id += rng.randint(1, 1 << 20)
+        creation_time = int(arrival) - int(rng.random() * jitter)
+        hashtags = HASHTAGS[rng.randrange(len(HASHTAGS))] if rng.random() < 0.2 else 'null'
+        mentions = '"%d;"' % user_id(sampler.sample()) if rng.random() < 0.4 else 'null'
+        reply_to = str(tweet_id - rng.randint(1, 1 << 30)) if rng.random() < 0.1 else 'null'
+        write(TEMPLATE % (hashtags, reply_to, creation_time, user_id(sampler.sample()), SOURCES[rng.randrange(len(SOURCES))],
+                          'true' if rng.random() < 0.3 else 'false', mentions, tweet_id))
+
+def parse_args(args=None):
+    parser = argparse.ArgumentParser(description='Synthetic tweet corpus generator for benchmarking Chirp')
+
+    help = 'Name and path of the corpus file. Use - to write to standard output. Default value is \'-\'.'
+    parser.add_argument('-o', action='store', dest='out_file', default='-', help=help)
+
+    help = 'Number of tweets to generate. Default value is 100,000.'
+    parser.add_argument('-n', action='store', type=int, dest='records', default=100000, help=help)
+
+    help = 'Average number of tweets per second. Default value is 500.'
+    parser.add_argument('-r', action='store', type=float, dest='rate', default=500, help=help)
+
+    help = 'Number of distinct users. Default value is 100,000.'
+    parser.add_argument('-u', action='store', type=int, dest='users', default=100000, help=help)
+
+    help = 'Zipf exponent of the user distribution. Use 0 for uniformly distributed users. Default value is 1.'
+    parser.add_argument('-z', action='store', type=float, dest='skew', default=1.0, help=help)
+
+    help = 'Maximum number of milliseconds timestamps lag behind the order of the records. Default value is 5000.'
+    parser.add_argument('-j', action='store', type=int, dest='jitter', default=5000, help=help)
+
+    help = 'Seed for the random number generator. Default value is 0.'
+    parser.add_argument('--seed', action='store', type=int, dest='seed', default=0, help=help)
+
+    args = parser.parse_args(args)
+
+    if args.records < 0 or args.rate <= 0 or args.users < 1 or args.jitter < 0:
+        parser.error('Number of tweets, rate, number of users and jitter must be positive')
+
+    return args
+
+if __name__ == '__main__':
+    args = parse_args()
+    if args.out_file == '-':
+        generate(sys.stdout, args.records, args.rate, args.users, args.skew, args.jitter, args.seed)
+    else:
+        with open(args.out_file, 'w', 1024*1024) as w:
+            generate(w, args.records, args.rate, args.users, args.skew, args.jitter, args.seed)
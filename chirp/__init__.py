@@ -1,5 +1,5 @@
 #!/usr/bin/env python
 #coding: utf-8
 
-__all__ = ['options_parser', 'external_sort', 'benchmark', 'rr_benchmark']
+__all__ = ['options_parser', 'external_sort', 'benchmark', 'rr_benchmark', 'dataset_stats', 'replay', 'binary_format', 'stats', 'checkpoint']
 
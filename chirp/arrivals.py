@@ -0,0 +1,154 @@
+#!/usr/bin/env python
+#coding: utf-8
+
+import random, itertools, collections
+
+
+# Read arrival models: poisson reads at the mean rate throughout, write-rate reads follow the local write rate over a
+# sliding window, piecewise reads follow a rate curve read from a file and mmpp reads alternate between quiet and bursty
+# periods of exponentially distributed lengths, i.e. a Markov-modulated Poisson process. Every model other than poisson
+# describes the read rate as segments of time with a constant rate each, which segment_reads turns into arrivals.
+ARRIVAL_MODELS = ('poisson', 'write-rate', 'piecewise', 'mmpp')
+
+# Number of bins per sliding window of the write-rate model
+WINDOW_BINS = 10
+
+
+# Read arrival generators. Each one yields (read_time, toss, sample) tuples, where read_time is the arrival time of the
+# read in milliseconds since the first write, toss picks between primary and secondary key reads, and sample picks the
+# key from the read buffer. Arrivals start after read_start and stop with the first read at or after the given duration.
+# Arrival times are kept as fractions of milliseconds, so that rates above one read per millisecond do not stall. The
+# write-rate model needs write_times, a function that returns the write timestamps from a given time on, and the mmpp
+# model draws its periods from period_seed, which defaults to the benchmark seed.
+def read_arrivals(lambda_for_reads, read_start, duration, benchmark_parameters, write_times=None, period_seed=None):
+    model = benchmark_parameters.arrival_model
+    if model == 'poisson':
+        return poisson_reads(lambda_for_reads, read_start, duration)
+
+    if model == 'write-rate':
+        window = benchmark_parameters.rate_window * 1000
+        segments = write_rate_segments(write_times(read_start - window), benchmark_parameters.rw_ratio, read_start,
+                                       duration, window)
+    elif model == 'piecewise':
+        segments = piecewise_segments(load_rate_curve(benchmark_parameters.rate_file), lambda_for_reads, read_start, duration)
+    else:
+        segments = mmpp_segments(lambda_for_reads, read_start, duration, benchmark_parameters.burst_ratio,
+                                 benchmark_parameters.burst_time * 1000, benchmark_parameters.quiet_time * 1000,
+                                 benchmark_parameters.seed if period_seed is None else period_seed)
+
+    return segment_reads(segments, lambda_for_reads, duration)
+
+# Seed of the periods of the mmpp model, chosen once per run so that all shards of the run and the runs that resume it
+# see the same bursts: the benchmark seed, or a random one if there is none
+def choose_period_seed(benchmark_parameters):
+    if benchmark_parameters.seed is not None:
+        return benchmark_parameters.seed
+    return random.SystemRandom().getrandbits(32)
+
+def poisson_reads(lambda_for_reads, read_start, duration):
+    expovariate = random.expovariate
+    uniform = random.random
+
+    read_time = read_start
+    while read_time < duration:
+        read_time += expovariate(lambda_for_reads)
+        yield read_time, uniform(), uniform()
+
+# Arrivals within segments of constant rate. Since arrivals are memoryless, every segment starts afresh at its start. The
+# last read arrives at the mean rate after the duration, so that generation writes every record.
+def segment_reads(segments, lambda_for_reads, duration):
+    expovariate = random.expovariate
+    uniform = random.random
+
+    for start, end, rate in segments:
+        if rate <= 0:
+            continue
+        read_time = start
+        while True:
+            read_time += expovariate(rate)
+            if read_time >= end:
+                break
+            yield read_time, uniform(), uniform()
+    yield duration + expovariate(lambda_for_reads), uniform(), uniform()
+
+# Counts the sorted write timestamps in consecutive bins of the given width, from first_bin on, forever
+def binned_counts(write_times, first_bin, width):
+    end = (first_bin + 1) * width
+    count = 0
+    for write_time in write_times:
+        if write_time < first_bin * width:
+            continue
+        while write_time >= end:
+            yield count
+            count = 0
+            end += width
+        count += 1
+    yield count
+    while True:
+        yield 0
+
+# Write-rate model: the read rate in every bin, a tenth of the window wide, is rw_ratio times the write rate in the
+# window centered on the bin. Windows are cut at the first and last record, so that reads do not thin out at the ends.
+def write_rate_segments(write_times, rw_ratio, read_start, duration, window):
+    width = window / float(WINDOW_BINS)
+    first_bin = int(read_start // width)
+    counts = binned_counts(write_times, first_bin - WINDOW_BINS // 2, width)
+    window_counts = collections.deque(itertools.islice(counts, WINDOW_BINS))
+    in_window = sum(window_counts)
+
+    for bin_ in itertools.count(first_bin):
+        start = max(bin_ * width, read_start)
+        if start >= duration:
+            return
+        window_start = max((bin_ - WINDOW_BINS // 2) * width, 0)
+        window_end = min((bin_ - WINDOW_BINS // 2 + WINDOW_BINS) * width, duration)
+        yield start, min((bin_ + 1) * width, duration), rw_ratio * in_window / float(window_end - window_start)
+        count = counts.next()
+        in_window += count - window_counts.popleft()
+        window_counts.append(count)
+
+# Reads a rate curve: one point per line with a time in seconds since the first write and the relative read rate from
+# that time on. Blank lines and lines starting with # are ignored. Returns the points sorted by time.
+def load_rate_curve(rate_file):
+    curve = []
+    with open(rate_file) as r:
+        for line in r:
+            line = line.strip()
+            if not line or line.startswith('#'):
+                continue
+            seconds, rate = line.split()
+            curve.append((float(seconds) * 1000, float(rate)))
+    curve.sort()
+    if not curve or any(rate < 0 for seconds, rate in curve) or not any(rate > 0 for seconds, rate in curve):
+        raise ValueError('Rate curve needs at least one point and non-negative rates, not all of them zero: %s' % rate_file)
+    return curve
+
+# Piecewise model: the rate curve holds its first rate before its first point. Rates are scaled so that the mean rate
+# over the whole duration is the mean read rate, independently of read_start, so that shards agree.
+def piecewise_segments(curve, lambda_for_reads, read_start, duration):
+    bounds = [0.0] + [min(max(seconds, 0.0), duration) for seconds, rate in curve[1:]] + [duration]
+    rates = [rate for seconds, rate in curve]
+    area = sum(rate * (end - start) for start, end, rate in zip(bounds, bounds[1:], rates))
+    scale = lambda_for_reads * duration / area if area > 0 else 0.0
+
+    for start, end, rate in zip(bounds, bounds[1:], rates):
+        start = max(start, read_start)
+        if start < end:
+            yield start, end, rate * scale
+
+# Markov-modulated model: quiet and bursty periods alternate, with exponentially distributed lengths of the given means,
+# and the bursty rate is burst_ratio times the quiet rate. Rates are scaled so that the long-run mean rate is the mean
+# read rate. The first period is bursty with the long-run probability of being in a burst. Periods are drawn from the
+# first record on with a generator of their own, seeded with a seed shared by all shards and resumed runs.
+def mmpp_segments(lambda_for_reads, read_start, duration, burst_ratio, burst_time, quiet_time, seed):
+    periods = random.Random(seed)
+    quiet_rate = lambda_for_reads * (quiet_time + burst_time) / (quiet_time + burst_ratio * burst_time)
+    bursty = periods.random() < burst_time / (quiet_time + burst_time)
+
+    start = 0.0
+    while start < duration:
+        end = min(start + periods.expovariate(1.0 / (burst_time if bursty else quiet_time)), duration)
+        if end > read_start:
+            yield max(start, read_start), end, quiet_rate * (burst_ratio if bursty else 1)
+        start = end
+        bursty = not bursty
@@ -1,99 +1,195 @@
 #!/usr/bin/env python
 #coding: utf-8
 
-import random, os, math
-from commons import ujson
+import math, itertools, functools, bisect
+import stats
+from sharding import generate_sharded, open_shard_input, shard_output_options, seed_generators
+from sorted_input import open_sorted_input, OffsetLines, sorted_file_name, sorted_timestamps
+from output import open_output, output_options, CommandBuffer
+from arrivals import read_arrivals, choose_period_seed
+from checkpoint import resume_offsets, open_checkpoints
+from record_fields import field_extractor, as_text, split_keys, secondary_command
 from ts_circular_buffer import TSCircularBuffer
+from ts_tree_buffer import TSTreeBuffer
+from ts_alias_buffer import TSAliasBuffer
+from popularity import key_popularity
 
 
-# Extracts information about the JSON file that has been sorted by the timestamp field
-def extractInfo(process_parameters, file_parameters):
-    input_ = (file_parameters.input_file if file_parameters.pre_sorted else file_parameters.sorted_file)
-    
-    timestamp = lambda data: data[process_parameters.time_field]
-    
-    first_tweet = ujson.loads(os.popen("head -1 " + input_).readlines()[0].strip())
-    last_tweet = ujson.loads(os.popen("tail -1 " + input_).readlines()[0].strip())
-    number_of_tweets = int(os.popen("wc -l " + input_).readlines()[0].strip().split()[0])
+# Benchmark generation code
+def generate_benchmark(process_parameters, benchmark_parameters, file_parameters, sorted_runs=None, resume_state=None):
+
+    if benchmark_parameters.shards > 1:
+        return generate_sharded(generate_shard, benchmark_parameters.read_buffer, process_parameters, benchmark_parameters, file_parameters)
+
+    # A resumed run continues reading the sorted file and writing the benchmark file where its checkpoint left off
+    seed_generators(benchmark_parameters.seed)
+    input_offset, output_offset = resume_offsets(resume_state)
+    with open_sorted_input(process_parameters, file_parameters, sorted_runs, input_offset) as (dataset_info, input_):
+        with open_output(file_parameters.output_file, append_at=output_offset, **output_options(process_parameters, file_parameters)) as w:
+            # Progress is measured in benchmark time
+            with stats.stage('generation', (dataset_info.max_time - dataset_info.zero_time) / benchmark_parameters.speedup) as progress:
+                with CommandBuffer(w, progress) as commands:
+                    checkpoints = open_checkpoints(process_parameters, file_parameters, benchmark_parameters, w, commands, resume_state)
+                    write_benchmark(process_parameters, benchmark_parameters, dataset_info, input_, commands, checkpoints=checkpoints,
+                                    sorted_name=None if sorted_runs is not None else sorted_file_name(file_parameters))
+
+
+# Picks the read buffer implementation. Popularity-skewed reads default to the alias buffer, which samples in constant
+# time however skewed the weights are.
+def read_buffer_class(benchmark_parameters):
+    if benchmark_parameters.tree_read_buffer:
+        return TSTreeBuffer
+    if benchmark_parameters.alias_read_buffer or benchmark_parameters.popularity != 'none':
+        return TSAliasBuffer
+    return TSCircularBuffer
+
+
+# Generates the commands of a single time shard. Runs in a worker process and returns the number of commands and bytes
+# written and the counters of the shard.
+def generate_shard(arguments):
+    process_parameters, benchmark_parameters, file_parameters, dataset_info, shard = arguments
+
+    stats.take_counters()
+    seed_generators(shard.seed)
+    with open_shard_input(file_parameters, shard) as input_:
+        with open_output(shard.output_file, **shard_output_options(process_parameters, file_parameters)) as w:
+            with CommandBuffer(w) as commands:
+                write_benchmark(process_parameters, benchmark_parameters, dataset_info, input_, commands, shard.read_start, shard.read_end,
+                                sorted_name=sorted_file_name(file_parameters), period_seed=shard.period_seed)
+    return commands.count, commands.bytes, stats.take_counters()
+
+
+# Writes benchmark commands for reads arriving from read_start until read_end, or until the end of the input if there is
+# no read_end. Records before read_start only warm up the read buffers. With checkpoints, the state of the generator is
+# saved periodically, and restored from the checkpoint of an earlier run if there is one.
+def write_benchmark(process_parameters, benchmark_parameters, dataset_info, input_, commands, read_start=0, read_end=None, checkpoints=None, sorted_name=None, period_seed=None):
     
-    return number_of_tweets, timestamp(last_tweet), timestamp(first_tweet)
+    resume_state = checkpoints.state if checkpoints is not None else None
+    lines_written = resume_state['lines_written'] if resume_state else 0
+    sorted_file = OffsetLines(input_, resume_state['input_offset'] if resume_state else 0)
 
+    # The periods of the mmpp arrival model come from one seed per run, shared by its shards and kept by its checkpoints
+    if resume_state:
+        period_seed = resume_state.get('period_seed', benchmark_parameters.seed)
+    elif period_seed is None:
+        period_seed = choose_period_seed(benchmark_parameters)
 
-# Benchmark generation code
-def generate_benchmark(process_parameters, benchmark_parameters, file_parameters):
+    number_of_tweets, max_time, zero_time = dataset_info.number_of_tweets, dataset_info.max_time, dataset_info.zero_time
+    if resume_state:
+        # Timestamps stay relative to the first record of the original run, even if an extension added earlier records
+        zero_time = resume_state['zero_time']
+    if read_end is None:
+        read_end = float('inf')
+
+    # Calculate parameter lambda for a Poisson distribution of reads
+    duration = max_time - zero_time
+    number_of_reads = float(benchmark_parameters.rw_ratio) * number_of_tweets
+    lambda_for_reads = number_of_reads / duration # in tweets per millisecond
+
+    # The write-rate arrival model follows the timestamps in the sorted file, read independently of the writes
+    write_times = None
+    if sorted_name is not None:
+        write_times = functools.partial(sorted_timestamps, process_parameters, sorted_name, dataset_info.time_index, zero_time)
     
-    lines_written = 0
-    with open((file_parameters.input_file if file_parameters.pre_sorted else file_parameters.sorted_file),'rb',1) as input_:
-        
-        sorted_file = (line.strip() for line in input_)
+    # Create a buffer per key field that will store a fixed number of previously written keys
+    ReadBuffer = read_buffer_class(benchmark_parameters)
+    key_fields = process_parameters.key_fields
+    buffers = [ReadBuffer(benchmark_parameters.read_buffer) for field in key_fields]
+    if resume_state:
+        buffers = list(resume_state['buffers'])
+    popularities = [key_popularity(benchmark_parameters, dataset_info, field) for field in key_fields]
+    tweets_p, popularity_p = buffers[0], popularities[0]
+    secondaries = zip(buffers[1:], popularities[1:])
+
+    # Writes pass the raw input line through, only the timestamp and key fields are extracted from it
+    extract_fields = field_extractor([process_parameters.time_field] + key_fields)
     
-        number_of_tweets, max_time, zero_time = extractInfo(process_parameters, file_parameters)
-
-        # Calculate parameter lambda for a Poisson distribution of reads
-        duration = max_time - zero_time
-        number_of_reads = float(benchmark_parameters.rw_ratio) * number_of_tweets
-        lambda_for_reads = number_of_reads / duration # in tweets per millisecond
-        
-        # Create a buffer that will store a fixed number of previously written tweets
-        tweets_p = TSCircularBuffer(benchmark_parameters.read_buffer)
-        tweets_s = TSCircularBuffer(benchmark_parameters.read_buffer)
-        id_p = lambda data: data[process_parameters.key_fields[0]]
-        id_s = lambda data: data[process_parameters.key_fields[1]]
-        
-        # Generate benchmark
-        read_time = 0
-        p_threshold = 1/(1 + float(benchmark_parameters.ps_ratio))
-        flush_limit = int(process_parameters.buffer_size / benchmark_parameters.rw_ratio)
-        write_count = 0
-        tweet_to_write = ujson.loads(sorted_file.next())
-        tweet_timestamp = tweet_to_write[process_parameters.time_field] - zero_time
-
-        with open(file_parameters.output_file, 'w', 64*1024) as w:
-            while read_time < duration:
-                read_time += int(random.expovariate(lambda_for_reads))
-
-                # Enter sorted writes into benchmark
-                while write_count < number_of_tweets and tweet_timestamp <= read_time:
-                    w.write('\t'.join([str(int(tweet_timestamp/benchmark_parameters.speedup)).zfill(8),
-                                       'w',ujson.dumps(tweet_to_write)])+'\n')
-                    
-                    lines_written += 1
-                    if lines_written == benchmark_parameters.output_limit:
-                        return
-                    
-                    # Insert the just-written tweet into the read buffer with a likelihood based on its timestamp and the freshness
-                    if id_p(tweet_to_write):
-                        tweets_p.insert(id_p(tweet_to_write), benchmark_parameters.freshness*tweet_timestamp/benchmark_parameters.speedup)
-                    if id_s(tweet_to_write):
-                        tweets_s.insert(id_s(tweet_to_write), benchmark_parameters.freshness*tweet_timestamp/benchmark_parameters.speedup)
-                    
-                    try:
-                        tweet_to_write = ujson.loads(sorted_file.next())
-                        tweet_timestamp = tweet_to_write[process_parameters.time_field] - zero_time
-                    except:
-                        pass
-                    write_count += 1
-                    if write_count % flush_limit == 0:
-                        w.flush()
-
-                # Generate random tweet to be read from the buffer
-                toss = random.random()
-                try:
-                    if toss > p_threshold:
-                        p_id = tweets_p.rand()
-                        if p_id:
-                            w.write('\t'.join([str(int(read_time/benchmark_parameters.speedup)).zfill(8),'rp',str(p_id)])+'\n')
-                            lines_written += 1
-                            if lines_written == benchmark_parameters.output_limit:
-                                return
-                    else:
-                        s_id = tweets_s.rand()
-                        if s_id:
-                            w.write('\t'.join([str(int(read_time/benchmark_parameters.speedup)).zfill(8),'rs',str(s_id)])+'\n')
-                            lines_written += 1
-                            if lines_written == benchmark_parameters.output_limit:
-                                return
-                    
-                except UnicodeEncodeError:
-                    pass
+    # Generate benchmark. Tosses above p_threshold read a primary key, tosses below it read a secondary key of the field
+    # whose share of p_threshold they fall into.
+    p_threshold = 1/(1 + float(benchmark_parameters.ps_ratio))
+    ratios = benchmark_parameters.secondary_ratios or [1.0] * len(secondaries)
+    s_thresholds = [p_threshold * sum(ratios[:index + 1]) / sum(ratios) for index in xrange(len(secondaries) - 1)] + [p_threshold]
+    s_commands = [secondary_command(index) + '\t' for index in xrange(len(secondaries))]
+
+    # Returns the next tweet to write with the values of its key fields, skipping unparsable lines. The end of the input
+    # gets an infinite timestamp.
+    def next_tweet():
+        for line_to_write in sorted_file:
+            try:
+                values = extract_fields(line_to_write)
+            except (ValueError, KeyError):
+                stats.count('skipped_lines')
+                continue
+            return line_to_write, values, values[0] - zero_time
+        return None, None, float('inf')
+
+    # Inserts the keys of a written tweet into the read buffers in a single pass, with a likelihood based on its
+    # timestamp and the freshness, skewed by the popularity of the keys. Multi-valued secondary keys are inserted one by
+    # one.
+    def remember(values, tweet_timestamp):
+        log_prob = benchmark_parameters.freshness*tweet_timestamp/benchmark_parameters.speedup
+        key_p = values[1]
+        if key_p:
+            tweets_p.insert(key_p, log_prob + popularity_p(key_p) if popularity_p else log_prob)
+        for (tweets_s, popularity_s), value in itertools.izip(secondaries, values[2:]):
+            for key_s in split_keys(value):
+                tweets_s.insert(key_s, log_prob + popularity_s(key_s) if popularity_s else log_prob)
+
+    line_to_write, values, tweet_timestamp = next_tweet()
+
+    # Warm up the read buffers with the records that precede the first read
+    while tweet_timestamp < read_start:
+        remember(values, tweet_timestamp)
+        line_to_write, values, tweet_timestamp = next_tweet()
+
+    if resume_state:
+        # Continue with the read that was about to be generated when the checkpoint was taken
+        arrivals = itertools.chain([resume_state['arrival']],
+                                   read_arrivals(lambda_for_reads, resume_state['arrival'][0], duration, benchmark_parameters, write_times, period_seed))
+    else:
+        arrivals = read_arrivals(lambda_for_reads, read_start, duration, benchmark_parameters, write_times, period_seed)
+
+    for read_time, toss, sample in arrivals:
+
+        # Checkpoint periodically, and before the last read so that the benchmark can be extended
+        if checkpoints is not None and (read_time >= duration or checkpoints.due()):
+            checkpoints.save(dict(zero_time = zero_time,
+                                  input_offset = sorted_file.offset if line_to_write is None else sorted_file.line_offset,
+                                  lines_written = lines_written,
+                                  period_seed = period_seed,
+                                  arrival = (read_time, toss, sample),
+                                  buffers = tuple(buffers)))
+
+        # Enter sorted writes into benchmark
+        while tweet_timestamp <= read_time and tweet_timestamp < read_end:
+            commands.add(int(tweet_timestamp/benchmark_parameters.speedup), 'w\t', line_to_write)
+            
+            lines_written += 1
+            if lines_written == benchmark_parameters.output_limit:
+                return
+            
+            # Insert the just-written tweet into the read buffers
+            remember(values, tweet_timestamp)
+            
+            line_to_write, values, tweet_timestamp = next_tweet()
+
+        # Reads from read_end on belong to the next shard
+        if read_time >= read_end:
+            break
 
+        # Generate random tweet to be read from the buffer
+        if toss > p_threshold:
+            p_id = tweets_p.sample(sample)
+            if p_id:
+                commands.add(int(read_time/benchmark_parameters.speedup), 'rp\t', as_text(p_id))
+                lines_written += 1
+                if lines_written == benchmark_parameters.output_limit:
+                    return
+        else:
+            field = bisect.bisect_left(s_thresholds, toss)
+            s_id = secondaries[field][0].sample(sample)
+            if s_id:
+                commands.add(int(read_time/benchmark_parameters.speedup), s_commands[field], as_text(s_id))
+                lines_written += 1
+                if lines_written == benchmark_parameters.output_limit:
+                    return
@@ -0,0 +1,244 @@
+#!/usr/bin/env python
+#coding: utf-8
+
+import os, mmap, struct, bisect, tempfile, shutil
+from compression import open_read, open_write
+
+
+# Compact binary benchmark format. A file consists of
+#  - a fixed-size header,
+#  - the payload region holding the JSON bodies of writes and any keys that are not 64-bit integers,
+#  - fixed-width command records: timestamp, command code, flags, a length and a reference. Integer keys are stored
+#    inline in the reference, with the width of a key range in the length. Other keys and write bodies are stored in the
+#    payload region, with their length and offset in the record,
+#  - a coarse timestamp index holding the timestamp and record number of every INDEX_INTERVAL-th record,
+#  - the table of command names, so that command codes are assigned as commands are first seen.
+# Readers map the file into memory, seek to any time offset through the index and iterate without copying payloads.
+
+MAGIC = 'CHIRPBIN'
+VERSION = 1
+INDEX_INTERVAL = 4096
+
+HEADER = struct.Struct('<8sIIQQQQQQQQ')
+RECORD = struct.Struct('<QBBIq')
+INDEX_ENTRY = struct.Struct('<QQ')
+
+# Record flags
+INLINE_KEYS = 1
+KEY_RANGE = 2
+
+INT64_MIN = -(1 << 63)
+INT64_MAX = (1 << 63) - 1
+UINT32_MAX = (1 << 32) - 1
+
+
+def is_binary_benchmark(path):
+    try:
+        with open(path,'rb') as r:
+            return r.read(len(MAGIC)) == MAGIC
+    except IOError:
+        return False
+
+def inline_key(text):
+    # Keys are stored inline if they are integers that convert back to exactly the same text
+    try:
+        key = int(text)
+    except ValueError:
+        return None
+    if not INT64_MIN <= key <= INT64_MAX or str(key) != text:
+        return None
+    return key
+
+
+class BinaryBenchmarkWriter():
+    '''A file-like object that accepts text benchmark commands, in chunks of any size, and writes them in the binary
+    format. Payloads are streamed to the output file right away, command records are spooled to a temporary file next to
+    it and appended on close. The output file has to be seekable.'''
+
+    def __init__(self, output_file):
+        '''Open the output file and the record spool and initialize state variables.'''
+
+        self._output = open(output_file, 'w+b', 1024*1024)
+        self._output.write('\0' * HEADER.size)
+        self._records = tempfile.TemporaryFile(dir=os.path.dirname(os.path.abspath(output_file)))
+        self._payload_size = 0
+        self._record_count = 0
+        self._index = []
+        self._codes = dict()
+        self._names = []
+        self._partial = ''
+
+
+    def write(self, text):
+        '''Encode complete command lines and keep any trailing partial line for the next call.'''
+
+        lines = (self._partial + text).split('\n')
+        self._partial = lines.pop()
+        for line in lines:
+            if line:
+                self._encode(line)
+
+
+    def writelines(self, lines):
+        for line in lines:
+            self.write(line)
+
+
+    def _encode(self, line):
+        '''Encode a single command line.'''
+
+        timestamp, command, value = line.split('\t', 2)
+        timestamp = int(timestamp)
+
+        if command not in self._codes:
+            self._codes[command] = len(self._names)
+            self._names.append(command)
+        if self._record_count % INDEX_INTERVAL == 0:
+            self._index.append((timestamp, self._record_count))
+
+        flags = 0
+        if command != 'w':
+            keys = value.split('\t')
+            if len(keys) == 1:
+                reference = inline_key(keys[0])
+                if reference is not None:
+                    flags = INLINE_KEYS
+                    length = 0
+            elif len(keys) == 2:
+                reference, last = inline_key(keys[0]), inline_key(keys[1])
+                if reference is not None and last is not None and 0 <= last - reference <= UINT32_MAX:
+                    flags = INLINE_KEYS | KEY_RANGE
+                    length = last - reference
+        if not flags:
+            reference = self._payload_size
+            length = len(value)
+            self._output.write(value)
+            self._payload_size += length
+
+        self._records.write(RECORD.pack(timestamp, self._codes[command], flags, length, reference))
+        self._record_count += 1
+
+
+    def flush(self):
+        pass
+
+
+    def close(self):
+        '''Append records, index and command names and write the header.'''
+
+        if self._partial:
+            self._encode(self._partial)
+            self._partial = ''
+
+        records_offset = HEADER.size + self._payload_size
+        self._records.seek(0)
+        shutil.copyfileobj(self._records, self._output, 1024*1024)
+        self._records.close()
+
+        index_offset = records_offset + self._record_count * RECORD.size
+        for entry in self._index:
+            self._output.write(INDEX_ENTRY.pack(*entry))
+
+        names_offset = index_offset + len(self._index) * INDEX_ENTRY.size
+        self._output.write('\0'.join(self._names))
+
+        self._output.seek(0)
+        self._output.write(HEADER.pack(MAGIC, VERSION, len(self._names), self._record_count, len(self._index),
+                                       INDEX_INTERVAL, HEADER.size, self._payload_size, records_offset, index_offset,
+                                       names_offset))
+        self._output.close()
+
+
+    def __enter__(self):
+        return self
+
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+
+class BinaryBenchmarkReader():
+    '''Memory-mapped reader for binary benchmark files. Commands are returned as (timestamp, command, value) tuples where
+    value is a buffer into the mapped payload for writes, and a tuple of one or two keys for reads. Keys are integers if
+    they were stored inline, strings otherwise. Seeking to a timestamp takes O(log N + INDEX_INTERVAL) time.'''
+
+    def __init__(self, path):
+        '''Map the file and read its header, index and command names.'''
+
+        self._file = open(path,'rb')
+        self._map = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ)
+
+        (magic, version, command_count, self._record_count, index_count, self._index_interval, self._payload_offset,
+         payload_size, self._records_offset, index_offset, names_offset) = HEADER.unpack_from(self._map, 0)
+        if magic != MAGIC or version != VERSION:
+            raise ValueError('Not a Chirp binary benchmark file: %s' % path)
+
+        self._index_times = [INDEX_ENTRY.unpack_from(self._map, index_offset + entry*INDEX_ENTRY.size)[0]
+                             for entry in xrange(index_count)]
+        self._names = self._map[names_offset:].split('\0') if command_count else []
+
+
+    def __len__(self):
+        '''Number of commands in the file.'''
+
+        return self._record_count
+
+
+    def __getitem__(self, position):
+        '''Command at a position in the file.'''
+
+        if not 0 <= position < self._record_count:
+            raise IndexError('BinaryBenchmarkReader index out of range')
+
+        timestamp, code, flags, length, reference = RECORD.unpack_from(self._map, self._records_offset + position*RECORD.size)
+        command = self._names[code]
+        if flags & KEY_RANGE:
+            return timestamp, command, (reference, reference + length)
+        if flags & INLINE_KEYS:
+            return timestamp, command, (reference,)
+
+        payload = buffer(self._map, self._payload_offset + reference, length)
+        if command == 'w':
+            return timestamp, command, payload
+        return timestamp, command, tuple(str(payload).split('\t'))
+
+
+    def seek(self, timestamp):
+        '''Position of the first command at or after a timestamp.'''
+
+        # Start from the last indexed record before the timestamp and scan forward
+        position = max(bisect.bisect_left(self._index_times, timestamp) - 1, 0) * self._index_interval
+        while position < self._record_count and self[position][0] < timestamp:
+            position += 1
+        return position
+
+
+    def commands(self, start_time=0):
+        '''Iterate over commands from a timestamp on.'''
+
+        for position in xrange(self.seek(start_time), self._record_count):
+            yield self[position]
+
+
+    def close(self):
+        self._map.close()
+        self._file.close()
+
+
+# Converts a benchmark file between the text and binary formats, detecting the format of the input. Text files may be
+# compressed.
+def convert(input_file, output_file):
+    if is_binary_benchmark(input_file):
+        reader = BinaryBenchmarkReader(input_file)
+        try:
+            with open_write(output_file) as w:
+                for timestamp, command, value in reader.commands():
+                    if command != 'w':
+                        value = '\t'.join(str(key) for key in value)
+                    w.write('%s\t%s\t%s\n' % (str(timestamp).zfill(8), command, value))
+        finally:
+            reader.close()
+    else:
+        with open_read(input_file) as r:
+            with BinaryBenchmarkWriter(output_file) as w:
+                w.writelines(r)
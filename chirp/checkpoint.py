@@ -0,0 +1,121 @@
+#!/usr/bin/env python
+#coding: utf-8
+
+import os, time, random, cPickle
+
+
+# Checkpoints of benchmark generation. A checkpoint holds everything a generator needs to continue where it left off:
+# the offset of the next record in the sorted file, the arrival of the next read, the state of the random number
+# generators, the read buffers and the size of the benchmark file written so far. Checkpoints are taken between reads,
+# after everything written so far has been flushed to disk, and once more before the last read, so that a finished
+# benchmark can be extended with records that arrive later. They are stored next to the benchmark file.
+CHECKPOINT_SUFFIX = '.checkpoint'
+CHECKPOINT_VERSION = 2
+
+# Number of reads between looks at the clock
+CHECK_EVERY = 4096
+
+# Parameters that may differ between a run and the run that resumes it
+RESUMABLE_CHANGES = ('output_limit',)
+
+# Processing parameters that decide how records are read, and must not differ between a run and the run that resumes it
+PROCESSING_FIELDS = ('time_field', 'sort_fields', 'key_fields')
+
+
+def checkpoint_name(output_file):
+    return output_file + CHECKPOINT_SUFFIX
+
+# Writes a checkpoint to a temporary file first and renames it, so that a crash never leaves a partial checkpoint
+def write_checkpoint(output_file, state):
+    name = checkpoint_name(output_file)
+    with open(name + '.tmp', 'wb') as w:
+        cPickle.dump(state, w, cPickle.HIGHEST_PROTOCOL)
+        w.flush()
+        os.fsync(w.fileno())
+    os.rename(name + '.tmp', name)
+
+# The processing parameters a checkpoint is taken with
+def processing_fields(process_parameters):
+    return dict((field, getattr(process_parameters, field)) for field in PROCESSING_FIELDS)
+
+# Loads the checkpoint of a benchmark file and checks that it was taken with the same benchmark parameters and the same
+# record fields, and that the output limit leaves something to generate
+def load_checkpoint(output_file, process_parameters, benchmark_parameters):
+    with open(checkpoint_name(output_file), 'rb') as r:
+        state = cPickle.load(r)
+
+    if state.get('version') != CHECKPOINT_VERSION:
+        raise ValueError('Unsupported checkpoint version: %s' % checkpoint_name(output_file))
+    changed = [field for field, value in benchmark_parameters._asdict().iteritems()
+               if field not in RESUMABLE_CHANGES and state['parameters'].get(field) != value]
+    if changed:
+        raise ValueError('Checkpoint was taken with different benchmark parameters: %s' % ', '.join(sorted(changed)))
+    changed = [field for field, value in processing_fields(process_parameters).iteritems()
+               if state['processing'].get(field) != value]
+    if changed:
+        raise ValueError('Checkpoint was taken with different record fields: %s' % ', '.join(sorted(changed)))
+    if benchmark_parameters.output_limit <= state['lines_written']:
+        raise ValueError('Output limit must be above the %d lines written before the checkpoint: %d' %
+                         (state['lines_written'], benchmark_parameters.output_limit))
+    return state
+
+# Offsets in the sorted file and in the benchmark file to continue from, None for a fresh run
+def resume_offsets(state):
+    if state is None:
+        return 0, None
+    return state['input_offset'], state['output_bytes']
+
+# Returns the checkpointer of a generator, or None if the run does not take checkpoints
+def open_checkpoints(process_parameters, file_parameters, benchmark_parameters, w, commands, state=None):
+    if file_parameters.checkpoint_interval is None:
+        return None
+    return Checkpointer(file_parameters.output_file, file_parameters.checkpoint_interval, process_parameters,
+                        benchmark_parameters, w, commands, state)
+
+
+class Checkpointer():
+    '''Takes the checkpoints of a generator writing commands through a CommandBuffer to a ThreadedWriter. A checkpointer
+    created from the state of an earlier run restores the random number generators and hands the rest of the state to
+    the generator.'''
+
+    def __init__(self, output_file, interval, process_parameters, benchmark_parameters, w, commands, state=None):
+        '''Initialize state variables and restore the random number generators of a resumed run.'''
+
+        self.state = state
+        self._output_file = output_file
+        self._interval = interval
+        self._parameters = benchmark_parameters._asdict()
+        self._processing = processing_fields(process_parameters)
+        self._w = w
+        self._commands = commands
+        self._output_bytes = state['output_bytes'] if state else 0
+        self._countdown = CHECK_EVERY
+        self._last = time.time()
+
+        if state:
+            random.setstate(state['random_state'])
+
+
+    def due(self):
+        '''Whether the interval has passed since the last checkpoint. Looks at the clock every CHECK_EVERY calls only.'''
+
+        self._countdown -= 1
+        if self._countdown:
+            return False
+        self._countdown = CHECK_EVERY
+        return time.time() - self._last >= self._interval
+
+
+    def save(self, state):
+        '''Flush the commands written so far to disk and save them along with the state of the generator: zero_time,
+        input_offset, lines_written, period_seed, arrival and buffers.'''
+
+        self._commands.flush()
+        self._w.sync()
+        state.update(version = CHECKPOINT_VERSION,
+                     parameters = self._parameters,
+                     processing = self._processing,
+                     output_bytes = self._output_bytes + self._commands.bytes,
+                     random_state = random.getstate())
+        write_checkpoint(self._output_file, state)
+        self._last = time.time()
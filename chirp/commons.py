@@ -8,11 +8,22 @@ try:
 except ImportError:
 	import json as ujson
 
-__all__ = ['ProcessingParameters', 'BenchmarkParameters', 'FileParameters', 'ujson']
+try:
+	import lzma
+except ImportError:
+	try:
+		from backports import lzma
+	except ImportError:
+		lzma = None
+
+__all__ = ['ProcessingParameters', 'BenchmarkParameters', 'FileParameters', 'DatasetInfo', 'Shard', 'ReplayParameters', 'ujson', 'lzma']
 
 
 # Define some named tuples to make downstream code more readable
-ProcessingParameters = collections.namedtuple('ProcessingParameters', 'buffer_size time_field sort_fields key_fields')
-BenchmarkParameters = collections.namedtuple('BenchmarkParameters', 'speedup rw_ratio ps_ratio freshness read_buffer output_limit read_range_width width_strictly_enforced keys_not_strings')
-FileParameters = collections.namedtuple('FileParameters', 'input_file pre_sorted sorted_file keep_sorted_file output_file temp_dirs')
+ProcessingParameters = collections.namedtuple('ProcessingParameters', 'buffer_size jobs max_fanin read_ahead spill_compression time_field sort_fields key_fields stats_file profile_stage')
+BenchmarkParameters = collections.namedtuple('BenchmarkParameters', 'speedup seed shards rw_ratio ps_ratio secondary_ratios freshness read_buffer tree_read_buffer alias_read_buffer popularity zipf_skew hot_fraction hot_share arrival_model rate_window rate_file burst_ratio burst_time quiet_time output_limit read_range_width width_strictly_enforced keys_not_strings bounded_range_reads')
+FileParameters = collections.namedtuple('FileParameters', 'input_file input_files pre_sorted stream_sorted sorted_file keep_sorted_file output_file output_format partitions partition_mode keep_shard_files temp_dirs checkpoint_interval resume extend')
+DatasetInfo = collections.namedtuple('DatasetInfo', 'number_of_tweets max_time zero_time key_cardinalities time_index')
+ReplayParameters = collections.namedtuple('ReplayParameters', 'benchmark_file store database key_fields concurrency queue_size time_scale limit report_file')
+Shard = collections.namedtuple('Shard', 'index seed period_seed read_start read_end offset output_file')
 
@@ -0,0 +1,222 @@
+#!/usr/bin/env python
+#coding: utf-8
+
+import os, gzip, bz2, threading, Queue, cStringIO
+from commons import lzma
+
+
+# Files are compressed if their name ends with one of these extensions. xz needs the lzma module, which is part of the
+# standard library from Python 3.3 on and available as backports.lzma before.
+EXTENSIONS = ('.gz', '.bz2', '.xz')
+SPILL_CODECS = {'none': '', 'gzip': '.gz', 'bz2': '.bz2', 'xz': '.xz'}
+
+# Compression level of spilled chunks, which are written once and read once, so speed matters more than size
+SPILL_LEVEL = 1
+
+# Size of the blocks handed between the main thread and the compression threads
+BLOCK_SIZE = 1024*1024
+
+
+def compression_extension(name):
+    extension = os.path.splitext(name)[1]
+    return extension if extension in EXTENSIONS else ''
+
+def is_compressed(name):
+    return compression_extension(name) != ''
+
+# Inserts a suffix before the compression extension, so that derived files are compressed like the original one
+def insert_suffix(name, suffix):
+    extension = compression_extension(name)
+    return name[:len(name) - len(extension)] + suffix + extension
+
+# Opens a file, compressed or not depending on its extension. Compressed files are read and written in the calling
+# thread; use open_read and open_write to move the codec work to a background thread.
+def open_file(name, mode, buffer_size=-1, level=None):
+    extension = compression_extension(name)
+    if extension == '.gz':
+        return gzip.open(name, mode, 6 if level is None else level)
+    if extension == '.bz2':
+        return bz2.BZ2File(name, mode, compresslevel = 9 if level is None else level)
+    if extension == '.xz':
+        if lzma is None:
+            raise IOError('xz compression needs the lzma module: %s' % name)
+        if 'w' in mode:
+            return lzma.LZMAFile(name, mode, preset = level)
+        return lzma.LZMAFile(name, mode)
+    return open(name, mode, buffer_size)
+
+# Opens a file for reading line by line. Compressed files are decompressed on a background thread.
+def open_read(name, buffer_size=64*1024):
+    if is_compressed(name):
+        return ThreadedReader(open_file(name, 'rb'))
+    return open(name, 'rb', buffer_size)
+
+# Opens a file for writing. Compressed files are compressed on a background thread, other files are written on one if
+# requested.
+def open_write(name, buffer_size=64*1024, level=None, background=False):
+    if is_compressed(name) or background:
+        return ThreadedWriter(open_file(name, 'wb', buffer_size, level))
+    return open(name, 'wb', buffer_size)
+
+# Reads a file in large sequential blocks on a background thread, so that the consumer keeps the disk busy, or the
+# decompressor, while the main thread works on the previous block. At most two blocks are held in memory besides the one
+# being processed.
+def prefetch_blocks(input_file, block_size):
+    blocks = Queue.Queue(2)
+
+    def reader():
+        try:
+            while True:
+                block = input_file.read(block_size)
+                blocks.put(block)
+                if not block:
+                    return
+        except Exception as e:
+            blocks.put(e)
+
+    thread = threading.Thread(target=reader)
+    thread.daemon = True
+    thread.start()
+
+    while True:
+        block = blocks.get()
+        if isinstance(block, Exception):
+            raise block
+        if not block:
+            return
+        yield block
+
+
+class ThreadedReader():
+    '''Iterates over the lines of a file object, typically a decompressing one, whose blocks are read on a background
+    thread.'''
+
+    def __init__(self, input_file, block_size=BLOCK_SIZE):
+        '''Start reading blocks in the background.'''
+
+        self._input_file = input_file
+        self._lines = self._read_lines(block_size)
+
+
+    def _read_lines(self, block_size):
+        '''Split blocks into lines, carrying partial lines over to the next block.'''
+
+        partial = ''
+        for block in prefetch_blocks(self._input_file, block_size):
+            block = partial + block
+            end = block.rfind('\n') + 1
+            partial = block[end:]
+            for line in cStringIO.StringIO(block[:end]):
+                yield line
+        if partial:
+            yield partial
+
+
+    def __iter__(self):
+        return self._lines
+
+
+    def next(self):
+        return self._lines.next()
+
+
+    def close(self):
+        self._input_file.close()
+
+
+    def __enter__(self):
+        return self
+
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+
+class ThreadedWriter():
+    '''Collects writes into large blocks and hands them to a background thread that writes them to a file object,
+    typically a compressing one. Errors of the background thread are raised by the next write or by close.'''
+
+    def __init__(self, output_file, block_size=BLOCK_SIZE):
+        '''Start the writer thread and initialize state variables.'''
+
+        self._output_file = output_file
+        self._block_size = block_size
+        self._pending = []
+        self._pending_size = 0
+        self._blocks = Queue.Queue(4)
+        self._errors = []
+        self._thread = threading.Thread(target=self._write_blocks)
+        self._thread.daemon = True
+        self._thread.start()
+
+
+    def _write_blocks(self):
+        '''Write blocks until the end marker. After an error, blocks are only drained.'''
+
+        try:
+            for block in iter(self._blocks.get, None):
+                try:
+                    self._output_file.write(block)
+                finally:
+                    self._blocks.task_done()
+        except Exception as error:
+            self._errors.append(error)
+            for block in iter(self._blocks.get, None):
+                self._blocks.task_done()
+
+
+    def write(self, text):
+        '''Add text to the current block and hand the block off once it is full.'''
+
+        self._pending.append(text)
+        self._pending_size += len(text)
+        if self._pending_size >= self._block_size:
+            self.flush()
+
+
+    def writelines(self, lines):
+        for line in lines:
+            self.write(line)
+
+
+    def flush(self):
+        '''Hand the current block to the writer thread.'''
+
+        if self._errors:
+            raise self._errors[0]
+        if self._pending:
+            self._blocks.put(''.join(self._pending))
+            self._pending = []
+            self._pending_size = 0
+
+
+    def sync(self):
+        '''Hand the current block to the writer thread and wait until all blocks are written and flushed to disk.'''
+
+        self.flush()
+        self._blocks.join()
+        if self._errors:
+            raise self._errors[0]
+        self._output_file.flush()
+        os.fsync(self._output_file.fileno())
+
+
+    def close(self):
+        '''Write the last block, wait for the writer thread and close the file.'''
+
+        try:
+            self.flush()
+        finally:
+            self._blocks.put(None)
+            self._thread.join()
+            self._output_file.close()
+        if self._errors:
+            raise self._errors[0]
+
+
+    def __enter__(self):
+        return self
+
+
+    def __exit__(self, *exc_info):
+        self.close()
@@ -0,0 +1,196 @@
+#!/usr/bin/env python
+#coding: utf-8
+
+import os, heapq
+from commons import ujson, DatasetInfo
+from record_fields import field_extractor, split_keys
+from compression import open_read
+
+
+# Sorted files get a metadata sidecar with this suffix, holding the record count, the time range, estimated key
+# cardinalities and a sparse index of byte offsets, so that later runs do not have to scan the file again. The sketches
+# behind the cardinality estimates are kept too, so that extending the file does not have to scan it either.
+SIDECAR_SUFFIX = '.meta'
+SIDECAR_VERSION = 2
+
+# Record the byte offset of every INDEX_INTERVAL-th record
+INDEX_INTERVAL = 100000
+
+MASK_64 = (1 << 64) - 1
+
+
+def mix_hash(key):
+    # splitmix64 finalizer over the built-in hash, so that sequential integer keys are spread evenly
+    h = hash(key) & MASK_64
+    h = ((h ^ (h >> 30)) * 0xbf58476d1ce4e5b9) & MASK_64
+    h = ((h ^ (h >> 27)) * 0x94d049bb133111eb) & MASK_64
+    return h ^ (h >> 31)
+
+
+class DistinctCounter():
+    '''A k-minimum-values sketch that estimates the number of distinct keys added to it in O(k) memory, with a relative
+    standard error of about 1/sqrt(k). Sketches built over separate parts of a dataset can be merged.'''
+
+    def __init__(self, k=1024):
+        '''Initialize storage structures.'''
+
+        self._k = k
+        self._heap = list()
+        self._hashes = set()
+
+
+    def add(self, key):
+        '''Add a key to the sketch.'''
+
+        self._addHash(mix_hash(key))
+
+
+    def addKeys(self, value):
+        '''Add the keys of a key field value, each key of a multi-valued field on its own.'''
+
+        for key in split_keys(value):
+            self._addHash(mix_hash(key))
+
+
+    def _addHash(self, h):
+        '''Keep the hash if it is among the k smallest seen so far. The heap holds negated hashes, so its top is the
+        largest hash kept.'''
+
+        if h in self._hashes:
+            return
+        if len(self._heap) < self._k:
+            heapq.heappush(self._heap, -h)
+            self._hashes.add(h)
+        elif h < -self._heap[0]:
+            self._hashes.discard(-heapq.heapreplace(self._heap, -h))
+            self._hashes.add(h)
+
+
+    def update(self, hashes):
+        '''Merge the hashes of another sketch into this one.'''
+
+        for h in hashes:
+            self._addHash(h)
+
+
+    def hashes(self):
+        '''The hashes kept by the sketch, e.g. to send it to another process.'''
+
+        return list(self._hashes)
+
+
+    def estimate(self):
+        '''Estimated number of distinct keys.'''
+
+        if len(self._heap) < self._k:
+            return len(self._heap)
+        return int((self._k - 1) * float(1 << 64) / (-self._heap[0] + 1))
+
+
+def sidecar_name(data_file):
+    return data_file + SIDECAR_SUFFIX
+
+# Sketches are given as lists of hashes by key field and stored as hexadecimal strings, which every JSON encoder handles
+def write_sidecar(data_file, info, sketches=None):
+    stat = os.stat(data_file)
+    sidecar = {'version': SIDECAR_VERSION,
+               'size': stat.st_size,
+               'mtime': int(stat.st_mtime),
+               'number_of_tweets': info.number_of_tweets,
+               'max_time': info.max_time,
+               'zero_time': info.zero_time,
+               'key_cardinalities': info.key_cardinalities,
+               'index_interval': INDEX_INTERVAL,
+               'time_index': info.time_index}
+    if sketches is not None:
+        sidecar['key_sketches'] = dict((field, ['%x' % h for h in hashes]) for field, hashes in sketches.iteritems())
+    try:
+        with open(sidecar_name(data_file), 'w') as w:
+            w.write(ujson.dumps(sidecar))
+    except IOError:
+        pass # read-only location, the file will be indexed again next time
+
+# Returns the sidecar of a data file as a dictionary, or None if there is no sidecar or it is out of date
+def load_sidecar(data_file):
+    try:
+        with open(sidecar_name(data_file)) as r:
+            sidecar = ujson.loads(r.read())
+    except (IOError, ValueError):
+        return None
+
+    stat = os.stat(data_file)
+    if (sidecar.get('version') != SIDECAR_VERSION or sidecar.get('size') != stat.st_size or
+            sidecar.get('mtime') != int(stat.st_mtime)):
+        return None
+    return sidecar
+
+# Returns the information stored in the sidecar of a data file, or None if there is no valid sidecar
+def read_sidecar(data_file):
+    sidecar = load_sidecar(data_file)
+    if sidecar is None:
+        return None
+
+    return DatasetInfo(number_of_tweets = sidecar['number_of_tweets'],
+                       max_time = sidecar['max_time'],
+                       zero_time = sidecar['zero_time'],
+                       key_cardinalities = sidecar['key_cardinalities'],
+                       time_index = [tuple(entry) for entry in sidecar['time_index']])
+
+# Returns the key sketches stored in the sidecar of a data file by key field, or None if there are none
+def read_sketches(data_file):
+    sidecar = load_sidecar(data_file)
+    if sidecar is None or 'key_sketches' not in sidecar:
+        return None
+    return dict((field, [int(h, 16) for h in hashes]) for field, hashes in sidecar['key_sketches'].iteritems())
+
+# Yields the lines it is given while recording, for every INDEX_INTERVAL-th line, its timestamp and byte offset in the
+# time index. Timestamps are taken from the first element of the keys that come with each line. Lines that continue a
+# file start at the given offset and record number.
+def index_lines(keyed_lines, time_index, offset=0, records=0):
+    countdown = -records % INDEX_INTERVAL
+    for key, line in keyed_lines:
+        if not countdown:
+            time_index.append((key[0], offset))
+            countdown = INDEX_INTERVAL
+        countdown -= 1
+        offset += len(line)
+        yield line
+
+# Dedicated indexing pass over a data file that has no valid sidecar, e.g. a pre-sorted input file. Unparsable lines are
+# not counted, since benchmark generation skips them.
+def index_file(process_parameters, data_file):
+    extract_fields = field_extractor([process_parameters.time_field] + process_parameters.key_fields)
+    counters = [DistinctCounter() for field in process_parameters.key_fields]
+    time_index = []
+
+    number_of_tweets = 0
+    max_time = None
+    zero_time = None
+    offset = 0
+    with open_read(data_file) as input_:
+        for line in input_:
+            try:
+                values = extract_fields(line)
+            except (ValueError, KeyError):
+                offset += len(line)
+                continue
+            timestamp = values[0]
+            if number_of_tweets % INDEX_INTERVAL == 0:
+                time_index.append((timestamp, offset))
+            if zero_time is None or timestamp < zero_time:
+                zero_time = timestamp
+            if max_time is None or timestamp > max_time:
+                max_time = timestamp
+            for counter, value in zip(counters, values[1:]):
+                if value is not None:
+                    counter.addKeys(value)
+            number_of_tweets += 1
+            offset += len(line)
+
+    info = DatasetInfo(number_of_tweets = number_of_tweets,
+                       max_time = max_time,
+                       zero_time = zero_time,
+                       key_cardinalities = dict(zip(process_parameters.key_fields, [counter.estimate() for counter in counters])),
+                       time_index = time_index)
+    write_sidecar(data_file, info, dict(zip(process_parameters.key_fields, [counter.hashes() for counter in counters])))
+    return info
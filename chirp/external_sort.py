@@ -1,36 +1,253 @@
 #!/usr/bin/env python
 #coding: utf-8
 
-import tempfile, heapq, os, collections, itertools
-from commons import ujson
+import tempfile, heapq, os, sys, bisect, collections, itertools, multiprocessing, operator, marshal, struct
+import stats
+from commons import ujson, DatasetInfo
+from dataset_stats import INDEX_INTERVAL, DistinctCounter, index_lines, write_sidecar, read_sidecar, read_sketches, index_file, sidecar_name
+from compression import SPILL_LEVEL, is_compressed, open_file, open_read, open_write, prefetch_blocks
+
+
+# kludge: magic key indicates unparsable json
+UNPARSABLE_KEY = (int('0xdbe928f86f85143c8282db0da081c05530ea2163', 16),)
+
+# Spilled chunks are stored as keyed records: a header with the lengths of the marshalled sort key and of the raw
+# line, followed by both. Keeping the key next to the line means merging never has to parse the JSON again.
+RECORD_HEADER = struct.Struct('<II')
 
 
 # External sort code
 # based on ActiveState Recipe 466302: Sorting big files the Python 2.4 way by Nicolas Lehuen &
 # ActiveState Recipe 576755: Sorting big files the Python 2.6 way by Gabriel Genellina
 # http://code.activestate.com/recipes/576755-sorting-big-files-the-python-26-way/
-def merge(key, *iterables):
+def merge(*keyed_iterables):
     # based on code posted by Scott David Daniels in c.l.p.
     # http://groups.google.com/group/comp.lang.python/msg/484f01f1ea3c832d
 
-    Keyed = collections.namedtuple("Keyed", ["key", "obj"])
-
-    keyed_iterables = [(Keyed(key(obj), obj) for obj in iterable) for iterable in iterables]
-    for element in heapq.merge(*keyed_iterables):
-        if element.key != (int('0xdbe928f86f85143c8282db0da081c05530ea2163', 16),):
-            yield element.obj
+    for key, obj in heapq.merge(*keyed_iterables):
+        if key != UNPARSABLE_KEY:
+            yield obj
         else:
             continue
 
-def batch_sort(process_parameters, file_parameters):
+def write_run(run_file, keyed_lines):
+    pack_header = RECORD_HEADER.pack
+    for key, line in keyed_lines:
+        packed_key = marshal.dumps(key)
+        run_file.write(pack_header(len(packed_key), len(line)) + packed_key + line)
+
+# Reads a run file in large sequential blocks on a background thread, so that the merge keeps the disk busy, and the
+# decompressor of compressed runs, while the main thread compares keys.
+def read_run(run_file, read_ahead):
+    header_size = RECORD_HEADER.size
+    unpack_header = RECORD_HEADER.unpack_from
+    loads = marshal.loads
+
+    buffer_ = ''
+    offset = 0
+    for block in prefetch_blocks(run_file, read_ahead):
+        buffer_ = buffer_[offset:] + block
+        offset = 0
+        end = len(buffer_)
+        while offset + header_size <= end:
+            key_length, line_length = unpack_header(buffer_, offset)
+            key_start = offset + header_size
+            line_start = key_start + key_length
+            record_end = line_start + line_length
+            if record_end > end:
+                break
+            yield loads(buffer_[key_start:line_start]), buffer_[line_start:record_end]
+            offset = record_end
+
+# Opens runs for merging. Input files that are sorted already take part in merges as they are, parsed for their sort keys
+# as they are read, without their unparsable lines.
+def open_runs(run_names, read_ahead, opened, sorted_files=(), sort_fields=None):
+    runs = []
+    for run_name in run_names:
+        if run_name in sorted_files:
+            input_file = open_read(run_name, read_ahead)
+            opened.append(input_file)
+            runs.append((key, line) for key, source, line in keyed_source(input_file, 0, sort_fields) if key != UNPARSABLE_KEY)
+            continue
+        run_file = open_file(run_name,'rb',0)
+        opened.append(run_file)
+        runs.append(read_run(run_file, read_ahead))
+    return runs
 
-    def sort_key(data):
-        try:
-            parsed_data = ujson.loads(data)
-        except:
-            return (int('0xdbe928f86f85143c8282db0da081c05530ea2163', 16),) # kludge: magic key indicates unparsable json
-        return tuple([parsed_data[field] for field in process_parameters.sort_fields])
+def sort_key(sort_fields, data):
+    try:
+        parsed_data = ujson.loads(data)
+    except:
+        return UNPARSABLE_KEY, None
+    return tuple([parsed_data[field] for field in sort_fields]), parsed_data
+
+# Sorts one chunk of lines and spills it to disk. Lives at module level so that it can be handed to worker processes.
+# Returns the number of parsable lines, the first and last timestamp in the chunk, taken from the first sort field, and
+# distinct counter sketches for the key fields.
+def sort_chunk(arguments):
+    chunk_name, current_chunk, sort_fields, key_fields = arguments
+
+    counters = [DistinctCounter() for field in key_fields]
+    keyed_chunk = []
+    for line in current_chunk:
+        key, parsed_data = sort_key(sort_fields, line)
+        keyed_chunk.append((key, line))
+        if parsed_data is not None:
+            for counter, field in zip(counters, key_fields):
+                if parsed_data.get(field) is not None:
+                    counter.addKeys(parsed_data[field])
+
+    keyed_chunk.sort(key=operator.itemgetter(0))
+    with open_write(chunk_name,64*1024,SPILL_LEVEL) as output_chunk:
+        write_run(output_chunk, keyed_chunk)
+
+    # Unparsable lines carry the magic key, which sorts after every real timestamp
+    count = len(keyed_chunk)
+    while count and keyed_chunk[count-1][0] == UNPARSABLE_KEY:
+        count -= 1
+    sketches = [counter.hashes() for counter in counters]
+    if not count:
+        return 0, None, None, sketches
+    return count, keyed_chunk[0][0][0], keyed_chunk[count-1][0][0], sketches
+
+
+# Checks the order of one chunk of an input file that may be sorted already and collects its statistics. Lives at module
+# level so that it can be handed to worker processes. Returns whether the parsable lines of the chunk are in order, their
+# first and last sort key, and the same statistics as sort_chunk, or None for the last three if they are not in order.
+def scan_chunk(arguments):
+    current_chunk, sort_fields, key_fields = arguments
+
+    counters = [DistinctCounter() for field in key_fields]
+    first_key = None
+    last_key = None
+    count = 0
+    for line in current_chunk:
+        key, parsed_data = sort_key(sort_fields, line)
+        if parsed_data is None:
+            continue
+        if last_key is not None and key < last_key:
+            return False, None, None, None
+        if first_key is None:
+            first_key = key
+        last_key = key
+        count += 1
+        for counter, field in zip(counters, key_fields):
+            if parsed_data.get(field) is not None:
+                counter.addKeys(parsed_data[field])
 
+    sketches = [counter.hashes() for counter in counters]
+    if not count:
+        return True, None, None, (0, None, None, sketches)
+    return True, first_key, last_key, (count, first_key[0], last_key[0], sketches)
+
+# Returns a function that runs a task on the pool, or right away without a pool, and returns a function giving its result
+def submitter(pool):
+    def submit(function, arguments):
+        if pool is None:
+            result = function(arguments)
+            return lambda: result
+        return pool.apply_async(function, (arguments,)).get
+    return submit
+
+# Reads an input file in chunks of buffer_size lines and updates the progress with every chunk, counting bytes from the
+# given position on. Every chunk is either sorted and spilled into a run of its own, named in chunk_names, or with scan,
+# only checked for order, and then reading stops at the first chunk out of order or not in order with the one before
+# it. A scan only counts its lines and bytes in the progress once the whole file is found in order, since a file out
+# of order is read again to be sorted. At most one chunk per job is kept waiting for the pool. Returns the number of
+# lines and bytes read and the statistics of the chunks, or None instead of the statistics if scanning found the file
+# out of order.
+def read_chunks(process_parameters, input_name, tempdirs, submit, progress, position, chunk_names, scan=False):
+    pending = collections.deque()
+    chunk_stats = []
+    last_key = None
+    lines_read = 0
+    bytes_read = 0
+    with open_read(input_name) as input_file:
+        input_iterator = iter(input_file)
+        for tempdir in itertools.cycle(tempdirs):
+            current_chunk = list(itertools.islice(input_iterator,process_parameters.buffer_size))
+            if current_chunk:
+                lines_read += len(current_chunk)
+                chunk_bytes = sum(itertools.imap(len, current_chunk))
+                bytes_read += chunk_bytes
+                if scan:
+                    progress.update(0, 0, position + bytes_read)
+                else:
+                    progress.update(len(current_chunk), chunk_bytes, position + bytes_read)
+                if scan:
+                    pending.append(submit(scan_chunk, (current_chunk, process_parameters.sort_fields, process_parameters.key_fields)))
+                else:
+                    chunk_names.append(os.path.join(tempdir,'%06i'%len(chunk_names)) + process_parameters.spill_compression)
+                    pending.append(submit(sort_chunk, (chunk_names[-1], current_chunk, process_parameters.sort_fields,
+                                                       process_parameters.key_fields)))
+
+            # Collect the results of the oldest chunks, and of all of them at the end of the file
+            while len(pending) > (process_parameters.jobs if current_chunk else 0):
+                if scan:
+                    in_order, first_key, chunk_last_key, statistics = pending.popleft()()
+                    if not in_order or (first_key is not None and last_key is not None and first_key < last_key):
+                        return lines_read, bytes_read, None
+                    last_key = chunk_last_key or last_key
+                else:
+                    statistics = pending.popleft()()
+                chunk_stats.append(statistics)
+            if not current_chunk:
+                break
+    if scan:
+        progress.update(lines_read, bytes_read)
+    return lines_read, bytes_read, chunk_stats
+
+
+class SortedRuns():
+    '''Sorted runs left on disk by the external sort. Iterating over them performs the final merge pass and yields the
+    sorted lines, so the merge can feed the benchmark generator directly instead of going through the sorted file.
+    Closing removes all temporary files.'''
+
+    def __init__(self, info, run_names, temp_names, read_ahead, sketches=None, sorted_files=(), sort_fields=None):
+        '''Initialize state variables. Runs named in sorted_files are input files sorted by sort_fields already.'''
+
+        self.info = info
+        self.sketches = sketches
+        self._run_names = run_names
+        self._temp_names = temp_names
+        self._read_ahead = read_ahead
+        self._sorted_files = sorted_files
+        self._sort_fields = sort_fields
+        self._opened = []
+
+
+    def __iter__(self):
+        '''Merge the runs and return an iterator over sorted lines, skipping unparsable ones.'''
+
+        return merge(*open_runs(self._run_names, self._read_ahead, self._opened, self._sorted_files, self._sort_fields))
+
+
+    def keyed_lines(self):
+        '''Merge the runs and return an iterator over (key, line) pairs, skipping unparsable lines.'''
+
+        return (element for element in heapq.merge(*open_runs(self._run_names, self._read_ahead, self._opened,
+                                                              self._sorted_files, self._sort_fields))
+                if element[0] != UNPARSABLE_KEY)
+
+
+    def close(self):
+        '''Close all runs and remove temporary files.'''
+
+        for run_file in self._opened:
+            try:
+                run_file.close()
+            except Exception:
+                pass
+        for temp_name in self._temp_names:
+            try:
+                os.remove(temp_name)
+            except Exception:
+                pass
+
+
+# Sorts chunks of the input file, or the input files, and runs intermediate merge passes until the final merge fits
+# within the maximum fan-in. Returns the remaining runs, along with the number of records and the time range of the dataset.
+def sort_runs(process_parameters, file_parameters):
 
     tempdirs = file_parameters.temp_dirs
 
@@ -39,28 +256,200 @@ def batch_sort(process_parameters, file_parameters):
     if not tempdirs:
         tempdirs.append(tempfile.gettempdir())
 
+    # With more than one job, chunks are sorted and spilled by a pool of worker processes. At most one chunk per worker
+    # is kept waiting in the queue so that memory use stays bounded by roughly (jobs + 2) * buffer_size lines.
+    pool = multiprocessing.Pool(process_parameters.jobs) if process_parameters.jobs > 1 else None
+    submit = submitter(pool)
+    chunk_stats = []
+    sorted_files = []
+
+    chunk_names = []
     chunks = []
+    lines_read = 0
+    bytes_read = 0
+    try:
+        # Progress is measured in bytes read, since the number of lines is not known in advance
+        input_files = file_parameters.input_files
+        input_size = None if any(itertools.imap(is_compressed, input_files)) else sum(itertools.imap(os.path.getsize, input_files))
+        with stats.stage('chunk-sort', input_size) as progress:
+            for input_name in input_files:
+                # Of several input files, those that are sorted already go straight into the final merge. They are only
+                # scanned for order and statistics, and sorted in chunks like a single input file if they are not.
+                if len(input_files) > 1:
+                    lines, bytes_, scanned = read_chunks(process_parameters, input_name, tempdirs, submit, progress,
+                                                         bytes_read, chunk_names, scan=True)
+                    if scanned is not None:
+                        sorted_files.append(input_name)
+                        chunk_stats.extend(scanned)
+                        lines_read += lines
+                        bytes_read += bytes_
+                        continue
+                lines, bytes_, sorted_ = read_chunks(process_parameters, input_name, tempdirs, submit, progress,
+                                                     bytes_read, chunk_names)
+                chunk_stats.extend(sorted_)
+                lines_read += lines
+                bytes_read += bytes_
+            if pool is not None:
+                pool.close()
+                pool.join()
+                pool = None
+
+        # Merge planner: while there are more runs than the maximum fan-in, merge the oldest runs into a new run at
+        # the back of the queue. Every intermediate run keeps its keys, so no pass needs to parse JSON again, except for
+        # input files that were sorted already.
+        read_ahead = process_parameters.read_ahead
+        runs = collections.deque(chunk_names + sorted_files)
+        while len(runs) > process_parameters.max_fanin:
+            merged_names = [runs.popleft() for _ in xrange(process_parameters.max_fanin)]
+            chunk_names.append(os.path.join(tempdirs[len(chunk_names) % len(tempdirs)],'%06i'%len(chunk_names)) + process_parameters.spill_compression)
+            with stats.stage('merge-pass') as progress:
+                with open_write(chunk_names[-1],read_ahead,SPILL_LEVEL) as output_run:
+                    write_run(output_run, progress.wrap(heapq.merge(*open_runs(merged_names, read_ahead, chunks, sorted_files,
+                                                                               process_parameters.sort_fields)),
+                                                        lambda keyed_line: len(keyed_line[1])))
+            while chunks:
+                chunks.pop().close()
+            for merged_name in merged_names:
+                if merged_name not in sorted_files:
+                    os.remove(merged_name)
+            runs.append(chunk_names[-1])
+    except:
+        if pool is not None:
+            pool.terminate()
+        for chunk in chunks:
+            chunk.close()
+        SortedRuns(None, [], chunk_names, process_parameters.read_ahead).close()
+        raise
+
+    # Unparsable lines carry the magic key and are dropped by the merge
+    stats.count('unparsable_lines', lines_read - sum(chunk[0] for chunk in chunk_stats))
+
+    counters = [DistinctCounter() for field in process_parameters.key_fields]
+    for count, first_time, last_time, sketches in chunk_stats:
+        for counter, hashes in zip(counters, sketches):
+            counter.update(hashes)
+
+    first_times = [chunk[1] for chunk in chunk_stats if chunk[0]]
+    last_times = [chunk[2] for chunk in chunk_stats if chunk[0]]
+    info = DatasetInfo(number_of_tweets = sum(chunk[0] for chunk in chunk_stats),
+                       max_time = max(last_times) if last_times else None,
+                       zero_time = min(first_times) if first_times else None,
+                       key_cardinalities = dict(zip(process_parameters.key_fields, [counter.estimate() for counter in counters])),
+                       time_index = None)
+
+    sketches = dict(zip(process_parameters.key_fields, [counter.hashes() for counter in counters]))
+    return SortedRuns(info, list(runs), chunk_names, read_ahead, sketches, sorted_files, process_parameters.sort_fields)
+
+def batch_sort(process_parameters, file_parameters):
+
+    sorted_runs = sort_runs(process_parameters, file_parameters)
+    time_index = []
     try:
-        with open(file_parameters.input_file,'rb',64*1024) as input_file:
-            input_iterator = iter(input_file)
-            for tempdir in itertools.cycle(tempdirs):
-                current_chunk = list(itertools.islice(input_iterator,process_parameters.buffer_size))
-                if not current_chunk:
+        with stats.stage('merge', sorted_runs.info.number_of_tweets) as progress:
+            with open(file_parameters.sorted_file,'wb',process_parameters.read_ahead) as output_file:
+                output_file.writelines(progress.wrap(index_lines(sorted_runs.keyed_lines(), time_index)))
+    finally:
+        sorted_runs.close()
+
+    # Leave the dataset statistics next to the sorted file, so that generation does not have to scan it again
+    info = sorted_runs.info._replace(time_index = time_index)
+    write_sidecar(file_parameters.sorted_file, info, sorted_runs.sketches)
+    return info
+
+# Yields (key, source, line) for the lines of a sorted file, parsing them for their sort key, and adds the key fields of
+# every parsed record to the counters. Lines get a trailing newline if they lack one.
+def keyed_source(lines, source, sort_fields, key_fields=(), counters=()):
+    for line in lines:
+        key, parsed_data = sort_key(sort_fields, line)
+        if parsed_data is not None:
+            for counter, field in zip(counters, key_fields):
+                if parsed_data.get(field) is not None:
+                    counter.addKeys(parsed_data[field])
+        yield key, source, line if line.endswith('\n') else line + '\n'
+
+# Merges the tail of a sorted file, starting at the given offset, with new sorted records and yields (key, line) pairs,
+# skipping unparsable lines. Records from the sorted file go first among equal keys. Counts the new records in tally,
+# along with the new records, and their bytes, that end up before the record at the mark offset of the sorted file, and
+# the last timestamp.
+def merge_tail(old_lines, offset, new_lines, mark, tally, process_parameters, counters):
+    merged = heapq.merge(keyed_source(old_lines, 0, process_parameters.sort_fields),
+                         keyed_source(new_lines, 1, process_parameters.sort_fields, process_parameters.key_fields, counters))
+    for key, source, line in merged:
+        if key == UNPARSABLE_KEY:
+            continue
+        if not source:
+            offset += len(line)
+        else:
+            tally['records'] += 1
+            if offset < mark:
+                tally['late'] += 1
+                tally['late_bytes'] += len(line)
+        tally['last_time'] = key[0]
+        yield key, line
+
+# Extends the sorted file with the records of the input file by merging them in, instead of sorting everything again.
+# The input file is sorted first unless it is pre-sorted. The sorted file is copied as is up to the last indexed record
+# that sorts before every new record, and only its tail is parsed and merged. Returns the offset in the extended file of
+# the record that was at the given offset in the sorted file, and the number of new records merged in before it.
+def extend_sorted(process_parameters, file_parameters, mark):
+    sorted_file = file_parameters.sorted_file
+    batch_file = file_parameters.input_file
+    if not file_parameters.pre_sorted:
+        batch_file = sorted_file + '.batch'
+        batch_sort(process_parameters, file_parameters._replace(sorted_file = batch_file))
+
+    try:
+        info = read_sidecar(sorted_file) or index_file(process_parameters, sorted_file)
+        sketches = read_sketches(sorted_file)
+        counters = [DistinctCounter() for field in process_parameters.key_fields]
+        for counter, field in zip(counters, process_parameters.key_fields):
+            counter.update((sketches or dict()).get(field, []))
+
+        # The first new record decides how much of the sorted file can be copied
+        first_key = UNPARSABLE_KEY
+        with open_read(batch_file) as batch:
+            for line in batch:
+                first_key = sort_key(process_parameters.sort_fields, line)[0]
+                if first_key != UNPARSABLE_KEY:
                     break
-                current_chunk.sort(key=sort_key)
-                output_chunk = open(os.path.join(tempdir,'%06i'%len(chunks)),'w+b',64*1024)
-                chunks.append(output_chunk)
-                output_chunk.writelines(current_chunk)
-                output_chunk.flush()
-                output_chunk.seek(0)
-        del current_chunk
-        with open(file_parameters.sorted_file,'wb',64*1024) as output_file:
-            output_file.writelines(merge(sort_key, *chunks))
+        if first_key == UNPARSABLE_KEY:
+            return mark, 0
+        entry = bisect.bisect_left([timestamp for timestamp, offset in info.time_index], first_key[0]) - 1
+        prefix_offset = info.time_index[entry][1] if entry >= 0 else 0
+        prefix_records = entry * INDEX_INTERVAL if entry >= 0 else 0
+
+        time_index = info.time_index[:max(entry, 0)]
+        tally = dict(records = 0, late = 0, late_bytes = 0, last_time = None)
+        extended_file = sorted_file + '.extending'
+        with stats.stage('merge') as progress:
+            with open(sorted_file, 'rb', process_parameters.read_ahead) as old, open_read(batch_file) as batch:
+                with open(extended_file, 'wb', process_parameters.read_ahead) as output_file:
+                    remaining = prefix_offset
+                    while remaining:
+                        block = old.read(min(remaining, process_parameters.read_ahead))
+                        output_file.write(block)
+                        remaining -= len(block)
+                    keyed_lines = merge_tail(old, prefix_offset, batch, mark, tally, process_parameters, counters)
+                    output_file.writelines(progress.wrap(index_lines(keyed_lines, time_index, prefix_offset, prefix_records)))
+        os.rename(extended_file, sorted_file)
     finally:
-        for chunk in chunks:
-            try:
-                chunk.close()
-                os.remove(chunk.name)
-            except Exception:
-                pass
+        if not file_parameters.pre_sorted:
+            for name in (batch_file, sidecar_name(batch_file)):
+                if os.path.exists(name):
+                    os.remove(name)
+
+    info = info._replace(number_of_tweets = info.number_of_tweets + tally['records'],
+                         max_time = max(info.max_time, tally['last_time']),
+                         zero_time = min(info.zero_time, first_key[0]),
+                         key_cardinalities = dict(zip(process_parameters.key_fields, [counter.estimate() for counter in counters])),
+                         time_index = time_index)
+    if sketches is None:
+        # Without the sketches of the sorted file, its cardinalities are only known after indexing it again
+        info = index_file(process_parameters, sorted_file)
+    else:
+        write_sidecar(sorted_file, info, dict(zip(process_parameters.key_fields, [counter.hashes() for counter in counters])))
 
+    if tally['late']:
+        stats.count('late_records', tally['late'])
+        sys.stderr.write('%d new records sort before the end of the existing benchmark and are left out of it\n' % tally['late'])
+    return mark + tally['late_bytes'], tally['late']
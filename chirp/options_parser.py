@@ -2,11 +2,32 @@
 #coding: utf-8
 
 import os, argparse, operator
-from commons import ProcessingParameters, BenchmarkParameters, FileParameters
+from commons import ProcessingParameters, BenchmarkParameters, FileParameters, ReplayParameters, lzma
+from compression import SPILL_CODECS, compression_extension, is_compressed
+from stats import STAGES
+from popularity import POPULARITY_MODELS
+from arrivals import ARRIVAL_MODELS, load_rate_curve
+from checkpoint import checkpoint_name, CHECKPOINT_SUFFIX
+from dataset_stats import SIDECAR_SUFFIX
+
+
+# Expands directories among the input paths into the files they contain, in name order, skipping hidden files and the
+# sidecars and checkpoints Chirp leaves next to its own files
+def expand_inputs(paths):
+    files = []
+    for path in paths:
+        if not os.path.isdir(path):
+            files.append(path)
+            continue
+        for name in sorted(os.listdir(path)):
+            if (not name.startswith('.') and not name.endswith((SIDECAR_SUFFIX, CHECKPOINT_SUFFIX)) and
+                    os.path.isfile(os.path.join(path, name))):
+                files.append(os.path.join(path, name))
+    return files
 
 
 # Command line options parser code
-def parse_args():
+def parse_args(args=None):
     usage = """./chirp.py -i IN_FILE [-o OUT_FILE] [-bs BUFFER_SIZE]
                           [-su SPEEDUP] [-rw RW_RATIO] [-ps PS_RATIO]"""
 
@@ -14,39 +35,108 @@ def parse_args():
 
     parser = argparse.ArgumentParser(usage=usage, description=description)
 
-    help = 'Name and path of input file containing one JSON record per line.'
-    parser.add_argument('-i', action='store', dest='in_file', required=True, help=help)
+    help = 'Names and paths of input files containing one JSON record per line, or of directories containing such files. Files ending in .gz, .bz2 or .xz are decompressed on the fly. Several input files are merged into the sorted file. Files that are already sorted are only scanned, in parallel chunks, and go straight into the final merge, the others are sorted in chunks like a single input file.'
+    parser.add_argument('-i', action='store', nargs='+', dest='in_files', required=True, help=help)
 
-    help = 'Use flag to set to True if the input file is pre-sorted by timestamp field. Default value is False.'
+    help = 'Use flag to set to True if the input file is pre-sorted by timestamp field, so that it can be read as the sorted file. Needs a single input file. Default value is False.'
     parser.add_argument('-p', action='store_true', dest='pre_sorted', default=False, help=help)
 
+    help = 'Use flag to stream the final merge pass of the sort directly into benchmark generation instead of writing and reading back the sorted intermediate file. Cannot be combined with the pre-sorted or keep-sorted-file flags. Default value is False.'
+    parser.add_argument('-st', action='store_true', dest='stream_sorted', default=False, help=help)
+
     help = 'Desired name and path of sorted intermediate file generated from the input file. Default value is \'sorted.dat\' in the current working directory.'
     parser.add_argument('-s', action='store', dest='sorted_file', default='sorted.dat', help=help)
 
     help = 'Use flag to set to True if you desire to keep the sorted intermediate file. Default value is same as pre-sorted flag.'
     parser.add_argument('-k', action='store_true', dest='keep_sorted_file', default=False, help=help)
 
-    help = 'Desired name and path of the output benchmark file. Default value is \'benchmark.file\' in the current working directory.'
+    help = 'Desired name and path of the output benchmark file. Use - to write to standard output, or the path of a named pipe to let a replay client consume commands while they are generated. Names ending in .gz, .bz2 or .xz are compressed on the fly. Default value is \'benchmark.file\' in the current working directory.'
     parser.add_argument('-o', action='store', dest='out_file', default='benchmark.file', help=help)
 
+    help = 'Format of the output benchmark file: text, or binary for a compact memory-mappable file with a timestamp index. Binary output needs a seekable output file. Default value is \'text\'.'
+    parser.add_argument('-of', action='store', dest='output_format', choices=['text', 'binary'], default='text', help=help)
+
+    help = 'Number of partition files to distribute the output over, so that one replay client per partition can reproduce the load together. Partition files are named after the output file with .p and the partition number appended. Default value is 1, i.e. no partitioning.'
+    parser.add_argument('-pt', action='store', type=int, dest='partitions', default=1, help=help)
+
+    help = 'How commands are assigned to partitions: hash of the primary key for writes and primary key reads and of the secondary key for secondary key reads, or round-robin in time order. Default value is \'hash\'.'
+    parser.add_argument('-pm', action='store', dest='partition_mode', choices=['hash', 'round-robin'], default='hash', help=help)
+
+    help = 'Save a checkpoint of benchmark generation every so many seconds, next to the output file with .checkpoint appended, and once more before the last read. Implies the keep-sorted-file flag. Needs a single shard writing text to a plain output file. Default value is None, i.e. no checkpoints, or 300 seconds when resuming or extending.'
+    parser.add_argument('-ckp', action='store', type=float, dest='checkpoint_interval', default=None, help=help)
+
+    help = 'Resume benchmark generation from the checkpoint of the output file, after a crash or an interruption, with the same options as the interrupted run. The output file is truncated to the checkpoint and extended. Resumed runs produce the same benchmark as an uninterrupted run. Use the resume flag to set to True. Default value is False.'
+    parser.add_argument('--resume', action='store_true', dest='resume', default=False, help=help)
+
+    help = 'Extend an existing benchmark with the newly arrived records of the input file. They are sorted, unless pre-sorted, and merged into the kept sorted file of the benchmark, then generation continues from the last checkpoint of the output file. New records that sort before the checkpoint are left out. Use the extend flag to set to True. Default value is False.'
+    parser.add_argument('--extend', action='store_true', dest='extend', default=False, help=help)
+
     help = 'List of temporary directories to store file chunks while sorting. Choosing multiple directories on different physical drives may speed up the sorting. Repeat flag and provide multiple directory names in any order. Default value is obtained from environment variables or available system paths.'
     parser.add_argument('-t', action='append', dest='temp_dirs', default=[], help=help)
 
     help = 'Desired speedup factor for timestamps in the output benchmark file. Default value is 100.'
     parser.add_argument('-su', action='store', type=float, dest='speedup', default=100, help=help)
 
+    help = 'Seed for the random number generators. Runs with the same seed and parameters produce byte-identical benchmark files. Default value is None, i.e. seeded from system randomness.'
+    parser.add_argument('--seed', action='store', type=int, dest='seed', default=None, help=help)
+
+    help = 'Number of time shards generated in parallel, each one in its own process. The read buffers of every shard are warmed up with the records that precede it. Default value is 1, i.e. no sharding.'
+    parser.add_argument('-sh', action='store', type=int, dest='shards', default=1, help=help)
+
+    help = 'Use flag to keep the benchmark of every shard in its own file, named after the output file with the shard number appended, instead of concatenating them. Default value is False.'
+    parser.add_argument('-ksh', action='store_true', dest='keep_shard_files', default=False, help=help)
+
     help = 'Desired reads to writes ratio in the output benchmark file. Default value is 30.'
-    parser.add_argument('-rw', action='store', type=float, dest='rw_ratio', default=30, help=help)
+    parser.add_argument('-rw', action='store', type=float, dest='rw_ratio', default=30.0, help=help)
 
     help = 'Desired reads on primary key to reads on secondary key ratio in the output benchmark file. Default value is 10.'
     parser.add_argument('-ps', action='store', type=float, dest='ps_ratio', default=10, help=help)
 
+    help = 'Share of reads on secondary keys that goes to each secondary key field, relative to the other secondary key fields. Repeat flag and provide one share per secondary key field, in the order of the key fields. Default value is an equal share for every secondary key field.'
+    parser.add_argument('-sr', action='append', type=float, dest='secondary_ratios', default=[], help=help)
+
     help = 'Desired freshness of reads. The higher the number the more likely are reads on recent writes. Default value is 0, i.e. all records in read buffer are equally likely to be picked - maximum \'staleness\'.'
     parser.add_argument('-f', action='store', type=float, dest='freshness', default=0, help=help)
 
     help = 'Read buffer size in terms of number of recently written IDs to remember for reading. Default value is 5,000 IDs.'
     parser.add_argument('-rb', action='store', type=int, dest='read_buffer', default=5000, help=help)
 
+    help = 'Use a segment tree to pick reads from the read buffer. It takes O(log N) time per write instead of rescaling the whole buffer on every rollover, and keeps probabilities accurate for high freshness values. Use the tree-read-buffer flag to set to True. Default value is False.'
+    parser.add_argument('-trb', action='store_true', dest='tree_read_buffer', default=False, help=help)
+
+    help = 'Use blocked alias tables to pick reads from the read buffer in O(1) time per read, however skewed the read distribution. Use the alias-read-buffer flag to set to True. Default value is False, unless reads are popularity-skewed and the tree read buffer is not used.'
+    parser.add_argument('-arb', action='store_true', dest='alias_read_buffer', default=False, help=help)
+
+    help = 'Popularity of keys in reads on single keys: none, zipf for Zipf-distributed key ranks, or hotspot for a small set of hot keys getting most reads. Applies to both primary and secondary keys and combines with freshness. Default value is \'none\'.'
+    parser.add_argument('-pop', action='store', dest='popularity', choices=POPULARITY_MODELS, default='none', help=help)
+
+    help = 'Zipf exponent of key popularity. Keys are ranked by a hash of their value among the estimated number of distinct keys. Default value is 1.'
+    parser.add_argument('-zs', action='store', type=float, dest='zipf_skew', default=1.0, help=help)
+
+    help = 'Fraction of hot keys with hotspot popularity. Default value is 0.01.'
+    parser.add_argument('-hf', action='store', type=float, dest='hot_fraction', default=0.01, help=help)
+
+    help = 'Share of reads going to hot keys with hotspot popularity, before freshness is applied. Default value is 0.9.'
+    parser.add_argument('-hs', action='store', type=float, dest='hot_share', default=0.9, help=help)
+
+    help = 'Arrival model of reads: poisson for a constant mean rate, write-rate for a rate following the local write rate, piecewise for a rate curve read from a file, or mmpp for bursts of reads alternating with quiet periods. All models keep the overall read/write ratio on average. Default value is \'poisson\'.'
+    parser.add_argument('-am', action='store', dest='arrival_model', choices=ARRIVAL_MODELS, default='poisson', help=help)
+
+    help = 'Width in seconds of the sliding window over which the write-rate arrival model measures the write rate. Default value is 60 seconds.'
+    parser.add_argument('-aw', action='store', type=float, dest='rate_window', default=60.0, help=help)
+
+    help = 'Rate curve of the piecewise arrival model: one point per line with a time in seconds since the first record and the relative read rate from that time on. Rates are scaled to the read/write ratio.'
+    parser.add_argument('-af', action='store', dest='rate_file', default=None, help=help)
+
+    help = 'Ratio between the read rate during bursts and the read rate during quiet periods with the mmpp arrival model. Default value is 10.'
+    parser.add_argument('-mb', action='store', type=float, dest='burst_ratio', default=10.0, help=help)
+
+    help = 'Mean length in seconds of bursts with the mmpp arrival model. Default value is 10 seconds.'
+    parser.add_argument('-mbt', action='store', type=float, dest='burst_time', default=10.0, help=help)
+
+    help = 'Mean length in seconds of quiet periods with the mmpp arrival model. Default value is 300 seconds.'
+    parser.add_argument('-mqt', action='store', type=float, dest='quiet_time', default=300.0, help=help)
+
     help = 'Limit total number of commands in the output benchmark file. Default value depends on the number of JSON records in the input file and the read/write ratio.'
     parser.add_argument('-lo', action='store', type=float, dest='output_limit', default=float('inf'), help=help)
 
@@ -59,52 +149,299 @@ def parse_args():
     help = 'Key values are sorted in lexicographic order to calculate range widths. Use the keys-not-strings flag to set to False. Default value is True.'
     parser.add_argument('-kns', action='store_false', dest='keys_not_strings', default=True, help=help)
 
+    help = 'Range read commands query for ranges among the most recently written keys only, bounded by the read buffer size like reads on single keys. Use the bounded-range-reads flag to set to True. Default value is False, i.e. ranges are drawn from all written keys.'
+    parser.add_argument('-brr', action='store_true', dest='bounded_range_reads', default=False, help=help)
+
     help = 'Memory buffer size for sorting in terms of number of lines of input file. Default value is 500,000 lines.'
     parser.add_argument('-bs', action='store', type=int, dest='buffer_size', default=500000, help=help)
 
+    help = 'Number of worker processes used to sort and spill chunks of the input file in parallel. Each worker holds up to two chunks in memory. Default value is 1, i.e. chunks are sorted sequentially.'
+    parser.add_argument('-j', action='store', type=int, dest='jobs', default=1, help=help)
+
+    help = 'Maximum number of sorted chunks merged at once. If sorting produces more chunks, intermediate merge passes are run first. Default value is 128 chunks.'
+    parser.add_argument('-mf', action='store', type=int, dest='max_fanin', default=128, help=help)
+
+    help = 'Read-ahead block size in kilobytes for every chunk being merged. Blocks are prefetched in the background, up to three blocks per chunk are held in memory. Default value is 1024 KB.'
+    parser.add_argument('-ra', action='store', type=int, dest='read_ahead', default=1024, help=help)
+
+    help = 'Compression of the chunks spilled to temporary directories while sorting: none, gzip, bz2 or xz. Saves temporary disk space at the expense of CPU time. Default value is \'none\'.'
+    parser.add_argument('-sc', action='store', dest='spill_compression', choices=sorted(SPILL_CODECS), default='none', help=help)
+
     help = 'Timestamp field in the JSON records. Default value is \'CreationTime\'.'
     parser.add_argument('-tf', action='store', dest='time_field', default='CreationTime', help=help)
 
     help = 'List of fields to be used to sort JSON records in the input file. Should include the timestamp field as the first field. Repeat flag and provide multiple fields in the required order. Default value is [\'CreationTime\', \'ID\'].'
     parser.add_argument('-sf', action='append', dest='sort_fields', default=[], help=help)
 
-    help = 'List of primary and secondary key fields. It should be possible to extract these fields and hold in memory for all records. Repeat flag and provide the primary key followed by the secondary key. Default value is [\'ID\', \'UserID\'].'
+    help = 'List of primary and secondary key fields. It should be possible to extract these fields and hold in memory for all records. Repeat flag and provide the primary key followed by one or more secondary keys, each of them read through its own read buffer and command, i.e. rs, rs2, rs3 and so on. String values of secondary keys are split at semicolons into the keys of multi-valued fields like \'Hashtags\'. Range reads need a single secondary key. Default value is [\'ID\', \'UserID\'].'
     parser.add_argument('-kf', action='append', dest='key_fields', default=[], help=help)
 
+    help = 'Report the progress of every stage, i.e. records/s, bytes/s and ETA, on standard error while running, count unparsable lines and write a JSON summary to the given file at the end. Default file is \'chirp_stats.json\'.'
+    parser.add_argument('--stats', action='store', dest='stats_file', nargs='?', const='chirp_stats.json', default=None, help=help)
+
+    help = 'Run one stage under cProfile: %s. The profile is written next to the statistics summary and its top functions are printed. Only covers the main process. Requires --stats.' % ', '.join(STAGES)
+    parser.add_argument('--profile', action='store', dest='profile_stage', choices=STAGES, default=None, help=help)
+
     parser.add_argument('-v', '--version', action='version', version='%(prog)s 3.0')
 
-    args = parser.parse_args()
+    args = parser.parse_args(args)
 
-    if not os.path.exists(args.in_file):
-        parser.error('Input file does not exist: %s' % args.in_file)
+    for in_file in args.in_files:
+        if not os.path.exists(in_file):
+            parser.error('Input file does not exist: %s' % in_file)
+
+    args.in_files = expand_inputs(args.in_files)
+    if not args.in_files:
+        parser.error('Input directories contain no files')
+    args.in_file = args.in_files[0]
+
+    if args.pre_sorted and len(args.in_files) > 1:
+        parser.error('Several input files cannot be read as one pre-sorted file; they are merged into the sorted file, without sorting the ones that are already sorted')
 
     if args.temp_dirs and not reduce(operator.and_, map(os.path.exists, args.temp_dirs)):
         for temp_dir in temp_dirs:
             if not os.path.exists(temp_dir):
                 parser.error('Temporary directory does not exist: %s' % temp_dir)
 
+    if args.stream_sorted and (args.pre_sorted or args.keep_sorted_file):
+        parser.error('Streaming the sort into benchmark generation leaves no sorted file to read or keep')
+
+    if args.shards < 1:
+        parser.error('Number of shards must be at least 1: %d' % args.shards)
+
+    if args.shards > 1 and args.stream_sorted:
+        parser.error('Sharded generation needs a sorted file to seek into and cannot be streamed')
+
+    if args.keep_shard_files and args.out_file == '-':
+        parser.error('Shard files cannot be kept when writing to standard output')
+
+    if args.output_format == 'binary' and args.out_file == '-':
+        parser.error('Binary output cannot be written to standard output')
+
+    if args.partitions < 1:
+        parser.error('Number of partitions must be at least 1: %d' % args.partitions)
+
+    if args.partitions > 1 and args.out_file == '-':
+        parser.error('Partitioned output cannot be written to standard output')
+
+    if lzma is None and '.xz' in map(compression_extension, args.in_files + [args.out_file]) + [SPILL_CODECS[args.spill_compression]]:
+        parser.error('xz compression requested but the lzma module could not be imported')
+
+    if args.output_format == 'binary' and is_compressed(args.out_file):
+        parser.error('Binary output is memory-mapped by readers and cannot be compressed')
+
+    if args.shards > 1 and args.pre_sorted and is_compressed(args.in_file):
+        parser.error('Sharded generation needs to seek into the sorted file, which cannot be a compressed pre-sorted input file')
+
+    if args.profile_stage and not args.stats_file:
+        parser.error('Profiling a stage requires --stats')
+
+    if args.tree_read_buffer and args.alias_read_buffer:
+        parser.error('Choose either the tree or the alias read buffer')
+
+    if args.popularity != 'none' and args.read_range_width > 1:
+        parser.error('Popularity-skewed reads apply to reads on single keys, not range reads')
+
+    if args.zipf_skew < 0:
+        parser.error('Zipf exponent must not be negative: %f' % args.zipf_skew)
+
+    if not (0 < args.hot_fraction < 1 and 0 < args.hot_share < 1):
+        parser.error('Fraction of hot keys and their share of reads must be between 0 and 1')
+
+    if len(args.key_fields) == 1:
+        parser.error('Key fields need a secondary key field besides the primary key field')
+
+    if args.secondary_ratios and (len(args.secondary_ratios) != len(args.key_fields or ['ID', 'UserID']) - 1 or
+                                  min(args.secondary_ratios) < 0 or not sum(args.secondary_ratios)):
+        parser.error('Give a non-negative share of secondary key reads for every secondary key field, not all of them zero')
+
+    if args.read_range_width > 1 and (args.secondary_ratios or len(args.key_fields) > 2):
+        parser.error('Range reads apply to the primary key field and a single secondary key field')
+
+    if args.arrival_model == 'write-rate' and args.stream_sorted:
+        parser.error('The write-rate arrival model reads the sorted file ahead of generation, which streaming does not write')
+
+    if args.arrival_model == 'piecewise':
+        if args.rate_file is None:
+            parser.error('The piecewise arrival model requires a rate curve file')
+        try:
+            load_rate_curve(args.rate_file)
+        except (IOError, ValueError) as e:
+            parser.error('Cannot read rate curve: %s' % e)
+
+    if min(args.rate_window, args.burst_ratio, args.burst_time, args.quiet_time) <= 0:
+        parser.error('Rate window, burst ratio and burst and quiet period lengths must be positive')
+
+    checkpoints = args.checkpoint_interval is not None or args.resume or args.extend
+    if checkpoints and (args.shards > 1 or args.stream_sorted or args.out_file == '-' or is_compressed(args.out_file) or
+                        args.output_format != 'text' or args.partitions > 1):
+        parser.error('Checkpoints need a single shard reading the sorted file and writing text to a plain output file')
+
+    if checkpoints and args.pre_sorted and not args.extend and is_compressed(args.in_file):
+        parser.error('Checkpoints need to seek into the sorted file, which cannot be a compressed pre-sorted input file')
+
+    if args.checkpoint_interval is not None and args.checkpoint_interval <= 0:
+        parser.error('Checkpoint interval must be positive: %f' % args.checkpoint_interval)
+
+    if args.resume and args.extend:
+        parser.error('Choose either to resume or to extend a benchmark')
+
+    if (args.resume or args.extend) and not os.path.exists(checkpoint_name(args.out_file)):
+        parser.error('Output file has no checkpoint to continue from: %s' % checkpoint_name(args.out_file))
+
+    if (args.extend or (args.resume and not args.pre_sorted)) and not os.path.exists(args.sorted_file):
+        parser.error('Sorted file of the benchmark does not exist: %s' % args.sorted_file)
+
+    if checkpoints:
+        args.checkpoint_interval = args.checkpoint_interval or 300.0
+        args.keep_sorted_file = True
+
+    if args.jobs < 1:
+        parser.error('Number of sorting jobs must be at least 1: %d' % args.jobs)
+
+    if args.max_fanin < 2:
+        parser.error('Maximum merge fan-in must be at least 2: %d' % args.max_fanin)
+
+    if args.read_ahead < 1:
+        parser.error('Read-ahead block size must be at least 1 KB: %d' % args.read_ahead)
+
     # set parameters
     process_parameters = ProcessingParameters(buffer_size = args.buffer_size,
+                                              jobs = args.jobs,
+                                              max_fanin = args.max_fanin,
+                                              read_ahead = args.read_ahead*1024,
+                                              spill_compression = SPILL_CODECS[args.spill_compression],
                                               time_field = args.time_field,
                                                      sort_fields = args.sort_fields if args.sort_fields else ['CreationTime', 'ID'],
-                                                     key_fields = args.key_fields if args.key_fields else ['ID', 'UserID'])
+                                                     key_fields = args.key_fields if args.key_fields else ['ID', 'UserID'],
+                                                     stats_file = args.stats_file,
+                                                     profile_stage = args.profile_stage)
 
     benchmark_parameters = BenchmarkParameters(speedup = args.speedup,
+                                                      seed = args.seed,
+                                                      shards = args.shards,
                                                       rw_ratio = args.rw_ratio,
                                                       ps_ratio = args.ps_ratio,
+                                                      secondary_ratios = args.secondary_ratios,
                                                       freshness = args.freshness,
                                                       read_buffer = args.read_buffer,
+                                                      tree_read_buffer = args.tree_read_buffer,
+                                                      alias_read_buffer = args.alias_read_buffer,
+                                                      popularity = args.popularity,
+                                                      zipf_skew = args.zipf_skew,
+                                                      hot_fraction = args.hot_fraction,
+                                                      hot_share = args.hot_share,
+                                                      arrival_model = args.arrival_model,
+                                                      rate_window = args.rate_window,
+                                                      rate_file = args.rate_file,
+                                                      burst_ratio = args.burst_ratio,
+                                                      burst_time = args.burst_time,
+                                                      quiet_time = args.quiet_time,
                                                       output_limit = args.output_limit,
                                                       read_range_width = args.read_range_width,
                                                       width_strictly_enforced = args.width_strictly_enforced,
-                                                      keys_not_strings = args.keys_not_strings)
+                                                      keys_not_strings = args.keys_not_strings,
+                                                      bounded_range_reads = args.bounded_range_reads)
 
     file_parameters = FileParameters(input_file = args.in_file,
+                                            input_files = args.in_files,
                                             pre_sorted = args.pre_sorted,
+                                            stream_sorted = args.stream_sorted,
                                             sorted_file = args.sorted_file,
                                             keep_sorted_file = args.keep_sorted_file,
                                             output_file = args.out_file,
-                                            temp_dirs = args.temp_dirs)
+                                            output_format = args.output_format,
+                                            partitions = args.partitions,
+                                            partition_mode = args.partition_mode,
+                                            keep_shard_files = args.keep_shard_files,
+                                            temp_dirs = args.temp_dirs,
+                                            checkpoint_interval = args.checkpoint_interval,
+                                            resume = args.resume,
+                                            extend = args.extend)
 
     return process_parameters, benchmark_parameters, file_parameters
 
+
+
+# Command line options parser code for the replay driver
+def parse_replay_args(args):
+    usage = """./run_chirp.py replay -i BENCHMARK_FILE [-st STORE] [-db DATABASE]
+                              [-c CONCURRENCY] [-ts TIME_SCALE]"""
+
+    description = 'Chirp benchmark replay driver v3.0'
+
+    parser = argparse.ArgumentParser(usage=usage, description=description)
+
+    help = 'Name and path of the benchmark file to replay, in text or binary format.'
+    parser.add_argument('-i', action='store', dest='benchmark_file', required=True, help=help)
+
+    help = 'Store adapter to send commands to: memory, sqlite, or module:Class for a custom adapter class. Default value is \'memory\'.'
+    parser.add_argument('-st', action='store', dest='store', default='memory', help=help)
+
+    help = 'Database file for the sqlite store adapter. Default value is \':memory:\', i.e. an in-memory database.'
+    parser.add_argument('-db', action='store', dest='database', default=':memory:', help=help)
+
+    help = 'List of primary and secondary key fields of the written JSON records. Repeat flag and provide the primary key followed by the secondary keys, in the order used to generate the benchmark. Default value is [\'ID\', \'UserID\'].'
+    parser.add_argument('-kf', action='append', dest='key_fields', default=[], help=help)
+
+    help = 'Number of worker threads sending commands to the store. Default value is 16.'
+    parser.add_argument('-c', action='store', type=int, dest='concurrency', default=16, help=help)
+
+    help = 'Maximum number of commands waiting for a worker. Commands keep their scheduled time while the dispatcher waits for room, so delays still show up in corrected latencies. Default value is 100,000 commands.'
+    parser.add_argument('-q', action='store', type=int, dest='queue_size', default=100000, help=help)
+
+    help = 'Replay speed relative to the timestamps in the benchmark file. Default value is 1, i.e. in real time.'
+    parser.add_argument('-ts', action='store', type=float, dest='time_scale', default=1, help=help)
+
+    help = 'Limit total number of commands to replay. Default value is all commands in the benchmark file.'
+    parser.add_argument('-lo', action='store', type=float, dest='limit', default=float('inf'), help=help)
+
+    help = 'Name and path of a file to write the replay report to as JSON. The report is always printed to standard error.'
+    parser.add_argument('-r', action='store', dest='report_file', default=None, help=help)
+
+    args = parser.parse_args(args)
+
+    if not os.path.exists(args.benchmark_file):
+        parser.error('Benchmark file does not exist: %s' % args.benchmark_file)
+
+    if args.concurrency < 1:
+        parser.error('Number of worker threads must be at least 1: %d' % args.concurrency)
+
+    if args.time_scale <= 0:
+        parser.error('Replay speed must be positive: %f' % args.time_scale)
+
+    return ReplayParameters(benchmark_file = args.benchmark_file,
+                            store = args.store,
+                            database = args.database,
+                            key_fields = args.key_fields if args.key_fields else ['ID', 'UserID'],
+                            concurrency = args.concurrency,
+                            queue_size = args.queue_size,
+                            time_scale = args.time_scale,
+                            limit = args.limit,
+                            report_file = args.report_file)
+
+
+
+# Command line options parser code for the benchmark file converter
+def parse_convert_args(args):
+    usage = """./run_chirp.py convert -i IN_FILE -o OUT_FILE"""
+
+    description = 'Chirp benchmark file converter v3.0'
+
+    parser = argparse.ArgumentParser(usage=usage, description=description)
+
+    help = 'Name and path of the benchmark file to convert. Text files are converted to binary and binary files to text.'
+    parser.add_argument('-i', action='store', dest='in_file', required=True, help=help)
+
+    help = 'Name and path of the converted benchmark file. Text files ending in .gz, .bz2 or .xz are compressed.'
+    parser.add_argument('-o', action='store', dest='out_file', required=True, help=help)
+
+    args = parser.parse_args(args)
+
+    if not os.path.exists(args.in_file):
+        parser.error('Benchmark file does not exist: %s' % args.in_file)
+
+    if lzma is None and '.xz' in (compression_extension(args.in_file), compression_extension(args.out_file)):
+        parser.error('xz compression requested but the lzma module could not be imported')
+
+    return args.in_file, args.out_file
@@ -0,0 +1,220 @@
+#!/usr/bin/env python
+#coding: utf-8
+
+import os, sys, zlib, threading, Queue, contextlib
+from binary_format import BinaryBenchmarkWriter
+from compression import ThreadedWriter, open_write, insert_suffix
+from record_fields import field_extractor, as_text
+
+
+# Number of lines collected for a partition before they are handed to its writer thread
+PARTITION_BATCH = 1000
+
+# Number of commands collected by the generators before they are handed to the output file
+COMMAND_BATCH = 16384
+
+
+# Options for open_output that write the final benchmark file as requested on the command line
+def output_options(process_parameters, file_parameters):
+    return dict(output_format = file_parameters.output_format,
+                partitions = file_parameters.partitions,
+                partition_mode = file_parameters.partition_mode,
+                key_field = process_parameters.key_fields[0])
+
+def partition_name(output_file, index):
+    return insert_suffix(output_file, '.p%03d' % index)
+
+# Opens the benchmark output file. A dash stands for standard output. Named pipes are opened like regular files, so a
+# replay client reading from the pipe can consume commands while the benchmark is still being generated. Binary output
+# is encoded from the text commands written to the returned file object. Text output is compressed if the name of the
+# output file ends with the extension of a compression format. With more than one partition, commands are distributed
+# over partition files named after the output file. Text output can be appended to a plain output file, after truncating
+# it to the given size, to continue an earlier run.
+@contextlib.contextmanager
+def open_output(output_file, output_format='text', partitions=1, partition_mode='hash', key_field=None, append_at=None):
+    if partitions > 1:
+        w = PartitionedWriter(output_file, output_format, partitions, partition_mode, key_field)
+        try:
+            yield w
+        finally:
+            w.close()
+    elif output_format == 'binary':
+        with BinaryBenchmarkWriter(output_file) as w:
+            yield w
+    elif output_file == '-':
+        sys.stdout.flush()
+        with ThreadedWriter(os.fdopen(os.dup(sys.stdout.fileno()), 'wb', 0)) as w:
+            yield w
+    elif append_at is not None:
+        with ThreadedWriter(open_truncated(output_file, append_at)) as w:
+            yield w
+    else:
+        with open_write(output_file, 0, background=True) as w:
+            yield w
+
+
+# Opens a file for appending after truncating it to the given size, which the file must have reached
+def open_truncated(output_file, size):
+    output_ = open(output_file, 'r+b', 0)
+    if os.fstat(output_.fileno()).st_size < size:
+        output_.close()
+        raise IOError('%s is shorter than the %d bytes it should continue from' % (output_file, size))
+    output_.truncate(size)
+    output_.seek(size)
+    return output_
+
+
+class CommandBuffer():
+    '''Collects the commands of a generator in a preallocated list of string parts and hands them to the output file in
+    blocks of COMMAND_BATCH commands, so that no string is built per command and the output file, usually written on a
+    background thread, gets few large writes. Timestamps are formatted once per distinct value, since consecutive
+    commands mostly share them. Counts the commands and bytes written, and updates the progress of generation with
+    every block, with the last timestamp as position.'''
+
+    def __init__(self, w, progress=None, batch=COMMAND_BATCH):
+        '''Initialize storage structures.'''
+
+        self._w = w
+        self._progress = progress
+        self.count = 0
+        self.bytes = 0
+        self._parts = [''] * (4 * batch)
+        self._size = 0
+        self._timestamp = None
+        self._prefix = None
+
+
+    def add(self, timestamp, command, value):
+        '''Add a command with a timestamp in milliseconds, a command name followed by a tab and a value.'''
+
+        if timestamp != self._timestamp:
+            self._timestamp = timestamp
+            self._prefix = '%08d\t' % timestamp
+        parts = self._parts
+        size = self._size
+        parts[size] = self._prefix
+        parts[size + 1] = command
+        parts[size + 2] = value
+        parts[size + 3] = '\n'
+        self._size = size + 4
+        if self._size == len(parts):
+            self.flush()
+
+
+    def flush(self):
+        '''Hand the collected commands to the output file.'''
+
+        if not self._size:
+            return
+        block = ''.join(self._parts if self._size == len(self._parts) else self._parts[:self._size])
+        self._w.write(block)
+        self.count += self._size // 4
+        self.bytes += len(block)
+        if self._progress is not None:
+            self._progress.update(self._size // 4, len(block), self._timestamp)
+        self._size = 0
+
+
+    def __enter__(self):
+        return self
+
+
+    def __exit__(self, *exc_info):
+        self.flush()
+
+
+class PartitionedWriter():
+    '''A file-like object that accepts text benchmark commands, in chunks of any size, and distributes them over partition
+    files, so that several replay clients can each replay one partition. Commands go to partitions either by a hash of
+    their key, the primary key for writes and primary key reads and the secondary key for secondary key reads, or
+    round-robin in time order. Every partition keeps the timestamp order of the commands and is written by its own
+    thread.'''
+
+    def __init__(self, output_file, output_format, partitions, partition_mode, key_field):
+        '''Start one writer thread per partition and initialize state variables.'''
+
+        self._partitions = partitions
+        self._partition_mode = partition_mode
+        self._extract_key = field_extractor([key_field])
+        self._pending = [[] for index in xrange(partitions)]
+        self._queues = [Queue.Queue(16) for index in xrange(partitions)]
+        self._errors = []
+        self._threads = []
+        self._next = 0
+        self._partial = ''
+        for index in xrange(partitions):
+            self._threads.append(threading.Thread(target=self._write_partition,
+                                                  args=(partition_name(output_file, index), output_format, self._queues[index])))
+            self._threads[-1].daemon = True
+            self._threads[-1].start()
+
+
+    def _write_partition(self, partition_file, output_format, batches):
+        '''Write batches of lines to a partition file until the end marker. After an error, batches are only drained.'''
+
+        try:
+            with open_output(partition_file, output_format) as w:
+                for batch in iter(batches.get, None):
+                    w.write(batch)
+        except Exception as error:
+            self._errors.append(error)
+            for batch in iter(batches.get, None):
+                pass
+
+
+    def _partition(self, line):
+        '''Partition a command line goes to.'''
+
+        if self._partition_mode == 'round-robin':
+            index = self._next
+            self._next = (index + 1) % self._partitions
+            return index
+
+        _, command, value = line.split('\t', 2)
+        if command == 'w':
+            key = as_text(self._extract_key(value)[0])
+        else:
+            key = value.split('\t', 1)[0]
+        return (zlib.crc32(key) & 0xffffffff) % self._partitions
+
+
+    def write(self, text):
+        '''Distribute complete command lines and keep any trailing partial line for the next call.'''
+
+        lines = (self._partial + text).split('\n')
+        self._partial = lines.pop()
+        for line in lines:
+            if line:
+                index = self._partition(line)
+                self._pending[index].append(line + '\n')
+                if len(self._pending[index]) == PARTITION_BATCH:
+                    self._queues[index].put(''.join(self._pending[index]))
+                    self._pending[index] = []
+
+
+    def writelines(self, lines):
+        for line in lines:
+            self.write(line)
+
+
+    def flush(self):
+        '''Hand all pending lines to the writer threads.'''
+
+        for index in xrange(self._partitions):
+            if self._pending[index]:
+                self._queues[index].put(''.join(self._pending[index]))
+                self._pending[index] = []
+
+
+    def close(self):
+        '''Write all pending lines, wait for the writer threads and raise the first error any of them ran into.'''
+
+        if self._partial:
+            self.write('\n')
+        self.flush()
+        for batches in self._queues:
+            batches.put(None)
+        for thread in self._threads:
+            thread.join()
+        if self._errors:
+            raise self._errors[0]
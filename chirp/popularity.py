@@ -0,0 +1,39 @@
+#!/usr/bin/env python
+#coding: utf-8
+
+import math
+from dataset_stats import mix_hash
+
+
+# Key popularity models. Every key gets a fixed popularity, derived from a hash of the key so that all occurrences of a
+# key and all shards agree on it without keeping state. Popularities are log-weights no greater than 0, added to the
+# freshness log-likelihood of the key when it enters a read buffer, so both models combine.
+POPULARITY_MODELS = ('none', 'zipf', 'hotspot')
+
+
+# Maps a key to a uniformly distributed fraction between 0 and 1
+def key_fraction(key):
+    return (mix_hash(key) >> 11) / float(1 << 53)
+
+# Zipf: the key gets a rank between 1 and the number of distinct keys and a weight of rank**-skew
+def zipf_popularity(cardinality, skew):
+    def popularity(key):
+        return -skew * math.log(1 + int(key_fraction(key) * cardinality))
+    return popularity
+
+# Hotspot: a fraction of the keys gets the given share of the reads, the remaining keys share the rest uniformly
+def hotspot_popularity(hot_fraction, hot_share):
+    cold = math.log(hot_fraction * (1 - hot_share) / ((1 - hot_fraction) * hot_share))
+    hot, cold = min(-cold, 0.0), min(cold, 0.0)
+    def popularity(key):
+        return hot if key_fraction(key) < hot_fraction else cold
+    return popularity
+
+# Returns the popularity function of keys of the given field, or None for uniform popularity
+def key_popularity(benchmark_parameters, dataset_info, key_field):
+    if benchmark_parameters.popularity == 'zipf':
+        cardinality = (dataset_info.key_cardinalities or dict()).get(key_field) or dataset_info.number_of_tweets
+        return zipf_popularity(max(int(cardinality), 1), benchmark_parameters.zipf_skew)
+    if benchmark_parameters.popularity == 'hotspot':
+        return hotspot_popularity(benchmark_parameters.hot_fraction, benchmark_parameters.hot_share)
+    return None
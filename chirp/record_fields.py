@@ -0,0 +1,43 @@
+#!/usr/bin/env python
+#coding: utf-8
+
+from commons import ujson
+
+
+# Separator of the keys of multi-valued fields, e.g. 'Hashtags' and 'UserMentions', which hold strings like 'a;b;'
+KEY_SEPARATOR = ';'
+
+
+def as_text(value):
+    if isinstance(value, unicode):
+        return value.encode('utf-8')
+    return str(value)
+
+# Keys of a secondary key field value. Strings are split into the keys of a multi-valued field. Empty and missing keys
+# are dropped, like empty primary keys.
+def split_keys(value):
+    if isinstance(value, basestring):
+        return [key for key in value.split(KEY_SEPARATOR) if key]
+    return [value] if value else []
+
+# Command of reads on the secondary key field with the given index: rs for the first one, rs2, rs3 and so on for the
+# others, so that every secondary index gets a command code of its own
+def secondary_command(index):
+    return 'rs' if index == 0 else 'rs%d' % (index + 1)
+
+# Index of the secondary key field a read command queries, or None for other commands
+def secondary_index(command):
+    if command == 'rs':
+        return 0
+    if command.startswith('rs') and command[2:].isdigit():
+        return int(command[2:]) - 1
+    return None
+
+# Returns a function that pulls the values of a few top-level fields out of a raw JSON line, for callers that pass the
+# line itself through. The whole line is parsed, which ujson does faster than any scan for the fields.
+def field_extractor(fields):
+    def extract(line):
+        parsed_data = ujson.loads(line)
+        return [parsed_data[field] for field in fields]
+
+    return extract
@@ -0,0 +1,343 @@
+#!/usr/bin/env python
+#coding: utf-8
+
+import sys, time, threading, Queue, sqlite3, importlib, collections, itertools
+from commons import ujson
+from record_fields import field_extractor, as_text, split_keys, secondary_index
+from binary_format import is_binary_benchmark, BinaryBenchmarkReader
+from compression import open_read
+
+
+# Open-loop replay driver. A dispatcher thread reads the benchmark file and hands every command to a pool of worker
+# threads at the time given by its timestamp, regardless of whether earlier commands have completed. Latencies are
+# recorded both from the time a command was actually sent and from the time it was scheduled to be sent. The latter
+# are corrected for coordinated omission: when the store falls behind, queueing delay shows up in them. Reads on
+# secondary key fields after the first one, i.e. rs2, rs3 and so on, are reported after the commands below.
+
+COMMANDS = ('w', 'rp', 'rs')
+PERCENTILES = (50, 90, 99, 99.9, 99.99)
+
+
+class LatencyHistogram():
+    '''A histogram of latencies in microseconds with log-linear buckets in the spirit of HdrHistogram. Values below
+    2**SUB_BUCKET_BITS are recorded exactly, larger values with a relative error below 2**-(SUB_BUCKET_BITS-1). Recording
+    is O(1) and memory grows with the logarithm of the largest value.'''
+
+    SUB_BUCKET_BITS = 8
+
+    def __init__(self):
+        '''Initialize storage structures.'''
+
+        self._counts = collections.defaultdict(int)
+        self.count = 0
+        self.total = 0
+        self.max = 0
+
+
+    def record(self, value):
+        '''Record a latency in microseconds.'''
+
+        value = max(int(value), 0)
+        self._counts[self._index(value)] += 1
+        self.count += 1
+        self.total += value
+        if value > self.max:
+            self.max = value
+
+
+    def update(self, other):
+        '''Add the counts of another histogram to this one.'''
+
+        for index, count in other._counts.iteritems():
+            self._counts[index] += count
+        self.count += other.count
+        self.total += other.total
+        self.max = max(self.max, other.max)
+
+
+    def _index(self, value):
+        '''Bucket index of a value.'''
+
+        bits = self.SUB_BUCKET_BITS
+        if value < 1 << bits:
+            return value
+        shift = value.bit_length() - bits
+        return ((shift + 1) << (bits - 1)) + (value >> shift)
+
+
+    def _value(self, index):
+        '''Largest value that falls into a bucket.'''
+
+        bits = self.SUB_BUCKET_BITS
+        if index < 1 << bits:
+            return index
+        shift = (index >> (bits - 1)) - 2
+        mantissa = index - ((shift + 1) << (bits - 1))
+        return ((mantissa + 1) << shift) - 1
+
+
+    def percentile(self, percentile):
+        '''Smallest recorded value, up to bucket precision, that is greater than or equal to the given percentage of
+        recorded values.'''
+
+        if not self.count:
+            return 0
+        threshold = percentile / 100.0 * self.count
+        seen = 0
+        for index in sorted(self._counts):
+            seen += self._counts[index]
+            if seen >= threshold:
+                return min(self._value(index), self.max)
+        return self.max
+
+
+    def summary(self):
+        '''Percentiles, mean and maximum as a dictionary.'''
+
+        summary = dict(('p%s' % percentile, self.percentile(percentile)) for percentile in PERCENTILES)
+        summary['mean'] = float(self.total) / self.count if self.count else 0
+        summary['max'] = self.max
+        return summary
+
+
+class MemoryStore():
+    '''Reference store adapter that keeps tweets in Python dictionaries, with one index per secondary key field. Range
+    reads scan all keys.'''
+
+    def __init__(self, replay_parameters):
+        '''Initialize storage structures.'''
+
+        self._extract_keys = field_extractor(replay_parameters.key_fields)
+        self._primary = dict()
+        self._secondaries = [collections.defaultdict(list) for field in replay_parameters.key_fields[1:]]
+        self._lock = threading.Lock()
+
+
+    def write(self, record):
+        '''Store a raw JSON record under its primary key and every one of its secondary keys.'''
+
+        values = self._extract_keys(record)
+        key_p = as_text(values[0])
+        with self._lock:
+            self._primary[key_p] = record
+            for secondary, value in zip(self._secondaries, values[1:]):
+                for key_s in split_keys(value):
+                    secondary[as_text(key_s)].append(key_p)
+
+
+    def read_primary(self, first, last=None):
+        '''Read the record with a primary key, or all records in a range of primary keys.'''
+
+        if last is None:
+            return self._primary.get(first)
+        return [record for key, record in self._primary.items() if first <= key <= last]
+
+
+    def read_secondary(self, first, last=None, field=0):
+        '''Read all records with a key of a secondary key field, or in a range of its keys. Fields are numbered from 0
+        in the order of the secondary key fields.'''
+
+        secondary = self._secondaries[field]
+        if last is None:
+            return [self._primary.get(key_p) for key_p in secondary.get(first, ())]
+        return [self._primary.get(key_p) for key, keys in secondary.items() if first <= key <= last for key_p in keys]
+
+
+    def close(self):
+        '''Release resources held by the store.'''
+
+        pass
+
+
+class SQLiteStore():
+    '''Reference store adapter backed by an SQLite database, with the secondary keys of all secondary key fields in an
+    indexed table of their own. Keys are stored as text, so range reads follow the lexicographic order used to generate
+    them.'''
+
+    def __init__(self, replay_parameters):
+        '''Connect to the database and create the tables if they do not exist.'''
+
+        self._extract_keys = field_extractor(replay_parameters.key_fields)
+        self._connection = sqlite3.connect(replay_parameters.database, check_same_thread=False)
+        self._connection.text_factory = str
+        self._connection.execute('CREATE TABLE IF NOT EXISTS tweets (pk TEXT PRIMARY KEY, body TEXT)')
+        self._connection.execute('CREATE TABLE IF NOT EXISTS tweet_keys (field INTEGER, sk TEXT, pk TEXT)')
+        self._connection.execute('CREATE INDEX IF NOT EXISTS tweet_keys_sk ON tweet_keys (field, sk)')
+        self._lock = threading.Lock()
+        self._pending = 0
+
+
+    def write(self, record):
+        '''Store a raw JSON record under its primary key and every one of its secondary keys.'''
+
+        values = self._extract_keys(record)
+        key_p = as_text(values[0])
+        keys = [(field, as_text(key_s), key_p) for field, value in enumerate(values[1:]) for key_s in split_keys(value)]
+        with self._lock:
+            self._connection.execute('INSERT OR REPLACE INTO tweets VALUES (?, ?)', (key_p, record))
+            self._connection.executemany('INSERT INTO tweet_keys VALUES (?, ?, ?)', keys)
+            self._pending += 1
+            if self._pending == 1000:
+                self._connection.commit()
+                self._pending = 0
+
+
+    def read_primary(self, first, last=None):
+        '''Read the record with a primary key, or all records in a range of primary keys.'''
+
+        with self._lock:
+            if last is None:
+                return self._connection.execute('SELECT body FROM tweets WHERE pk = ?', (first,)).fetchall()
+            return self._connection.execute('SELECT body FROM tweets WHERE pk BETWEEN ? AND ?', (first, last)).fetchall()
+
+
+    def read_secondary(self, first, last=None, field=0):
+        '''Read all records with a key of a secondary key field, or in a range of its keys. Fields are numbered from 0
+        in the order of the secondary key fields.'''
+
+        with self._lock:
+            if last is None:
+                return self._connection.execute('SELECT body FROM tweet_keys JOIN tweets USING (pk) WHERE field = ? AND sk = ?',
+                                                (field, first)).fetchall()
+            return self._connection.execute('SELECT body FROM tweet_keys JOIN tweets USING (pk) WHERE field = ? AND sk BETWEEN ? AND ?',
+                                            (field, first, last)).fetchall()
+
+
+    def close(self):
+        '''Release resources held by the store.'''
+
+        with self._lock:
+            self._connection.commit()
+            self._connection.close()
+
+
+STORES = {'memory': MemoryStore, 'sqlite': SQLiteStore}
+
+# Returns the store adapter class for a name, either one of the reference adapters or 'module:Class' for a custom adapter
+# with the same write/read_primary/read_secondary/close methods. Custom adapters only need the field argument of
+# read_secondary to replay benchmarks with more than one secondary key field.
+def store_class(name):
+    if name in STORES:
+        return STORES[name]
+    module_name, _, class_name = name.partition(':')
+    return getattr(importlib.import_module(module_name), class_name)
+
+# Iterates over the (timestamp, command, value) commands of a text or binary benchmark file, with values as in text files
+def benchmark_commands(benchmark_file):
+    if is_binary_benchmark(benchmark_file):
+        reader = BinaryBenchmarkReader(benchmark_file)
+        try:
+            for timestamp, command, value in reader.commands():
+                yield timestamp, command, str(value) if command == 'w' else '\t'.join(str(key) for key in value)
+        finally:
+            reader.close()
+    else:
+        with open_read(benchmark_file) as lines:
+            for line in lines:
+                timestamp, command, value = line.rstrip('\n').split('\t', 2)
+                yield int(timestamp), command, value
+
+def execute(store, command, value):
+    if command == 'w':
+        store.write(value)
+    elif command == 'rp':
+        store.read_primary(*value.split('\t'))
+    elif command == 'rs':
+        store.read_secondary(*value.split('\t'))
+    elif secondary_index(command) is not None:
+        store.read_secondary(*value.split('\t'), field=secondary_index(command))
+
+def worker(store, commands, histograms, errors):
+    while True:
+        task = commands.get()
+        if task is None:
+            return
+        scheduled, command, value = task
+        sent = time.time()
+        try:
+            execute(store, command, value)
+        except Exception:
+            errors[command] += 1
+        done = time.time()
+        histograms[command][0].record((done - scheduled) * 1e6)
+        histograms[command][1].record((done - sent) * 1e6)
+
+def replay(replay_parameters):
+    store = store_class(replay_parameters.store)(replay_parameters)
+
+    # Every worker records into its own histograms, which are merged at the end
+    commands = Queue.Queue(replay_parameters.queue_size)
+    worker_histograms = []
+    worker_errors = []
+    threads = []
+    for index in xrange(replay_parameters.concurrency):
+        worker_histograms.append(collections.defaultdict(lambda: (LatencyHistogram(), LatencyHistogram())))
+        worker_errors.append(collections.defaultdict(int))
+        threads.append(threading.Thread(target=worker, args=(store, commands, worker_histograms[-1], worker_errors[-1])))
+        threads[-1].daemon = True
+        threads[-1].start()
+
+    # Dispatch commands on schedule. If the queue is full the dispatcher blocks, but commands keep their scheduled time.
+    max_lag = 0.0
+    dispatched = 0
+    start = time.time()
+    for timestamp, command, value in benchmark_commands(replay_parameters.benchmark_file):
+        if dispatched == replay_parameters.limit:
+            break
+        scheduled = start + timestamp / 1000.0 / replay_parameters.time_scale
+        delay = scheduled - time.time()
+        if delay > 0.001:
+            time.sleep(delay)
+        elif delay < 0:
+            max_lag = max(max_lag, -delay)
+        commands.put((scheduled, command, value))
+        dispatched += 1
+
+    for thread in threads:
+        commands.put(None)
+    for thread in threads:
+        thread.join()
+    elapsed = time.time() - start
+    store.close()
+
+    report = {'elapsed_seconds': elapsed,
+              'commands': dispatched,
+              'throughput': dispatched / elapsed if elapsed else 0,
+              'max_dispatch_lag_ms': max_lag * 1e3}
+    for command in report_commands(set(itertools.chain.from_iterable(worker_histograms))):
+        corrected, uncorrected = LatencyHistogram(), LatencyHistogram()
+        for histograms in worker_histograms:
+            if command in histograms:
+                corrected.update(histograms[command][0])
+                uncorrected.update(histograms[command][1])
+        if not corrected.count:
+            continue
+        report[command] = {'count': corrected.count,
+                           'errors': sum(errors[command] for errors in worker_errors),
+                           'throughput': corrected.count / elapsed if elapsed else 0,
+                           'latency_us': uncorrected.summary(),
+                           'corrected_latency_us': corrected.summary()}
+
+    print_report(report)
+    if replay_parameters.report_file:
+        with open(replay_parameters.report_file, 'w') as w:
+            w.write(ujson.dumps(report))
+    return report
+
+# Commands in report order: writes, primary key reads and then secondary key reads by field. Other names are left out.
+def report_commands(names):
+    order = dict((command, index) for index, command in enumerate(COMMANDS))
+    for name in names:
+        if name not in order and secondary_index(name) is not None:
+            order[name] = len(COMMANDS) + secondary_index(name)
+    return sorted((name for name in names if name in order), key=order.get)
+
+def print_report(report, out=sys.stderr):
+    out.write('%d commands in %.1f s, %.0f commands/s, max dispatch lag %.1f ms\n' %
+              (report['commands'], report['elapsed_seconds'], report['throughput'], report['max_dispatch_lag_ms']))
+    columns = ['p%s' % percentile for percentile in PERCENTILES] + ['max']
+    out.write('%-4s %-10s %10s %8s  %s\n' % ('cmd', 'latency', 'count', 'errors', ' '.join('%9s' % column for column in columns)))
+    for command in report_commands(report):
+        for name, key in (('actual', 'latency_us'), ('corrected', 'corrected_latency_us')):
+            out.write('%-4s %-10s %10d %8d  %s\n' % (command, name, report[command]['count'], report[command]['errors'],
+                                                     ' '.join('%9d' % report[command][key][column] for column in columns)))
@@ -0,0 +1,105 @@
+#!/usr/bin/env python
+#coding: utf-8
+
+import os, random, bisect, shutil, itertools, contextlib, multiprocessing
+import stats
+from commons import Shard
+from dataset_stats import INDEX_INTERVAL
+from sorted_input import extractInfo
+from arrivals import choose_period_seed
+from output import open_output, output_options
+from compression import open_read, insert_suffix
+
+
+# Seeds the random number generators of the current process. Without a seed they are seeded from system randomness,
+# so that worker processes forked from the same parent do not produce identical streams.
+def seed_generators(seed):
+    random.seed(seed)
+
+# Splits the time range of the dataset into equal shards. Every shard starts reading the sorted file at least
+# warm_records records before its first read, using the time index, so that its read buffers can be warmed up with the
+# preceding records. Without warm_records, shards warm up from the start of the file.
+def plan_shards(benchmark_parameters, file_parameters, dataset_info, warm_records):
+    shards = benchmark_parameters.shards
+    duration = dataset_info.max_time - dataset_info.zero_time
+    bounds = [duration*index//shards for index in xrange(shards)] + [None]
+
+    # Derive one seed per shard from the global seed
+    if benchmark_parameters.seed is not None:
+        seeds = random.Random(benchmark_parameters.seed)
+        shard_seeds = [seeds.getrandbits(32) for index in xrange(shards)]
+    else:
+        shard_seeds = [None] * shards
+    period_seed = choose_period_seed(benchmark_parameters)
+
+    index_times = [timestamp for timestamp, offset in dataset_info.time_index]
+    plan = []
+    for index in xrange(shards):
+        entry = max(bisect.bisect_left(index_times, dataset_info.zero_time + bounds[index]) - 1, 0)
+        if warm_records is None:
+            entry = 0
+        else:
+            entry = max(entry - (warm_records + INDEX_INTERVAL - 1)//INDEX_INTERVAL, 0)
+        plan.append(Shard(index = index,
+                          seed = shard_seeds[index],
+                          period_seed = period_seed,
+                          read_start = bounds[index],
+                          read_end = bounds[index + 1],
+                          offset = dataset_info.time_index[entry][1] if dataset_info.time_index else 0,
+                          output_file = shard_name(file_parameters, index)))
+    return plan
+
+# Kept shard files are named like the output file, with the shard number inserted before any compression extension.
+# Shard files that are only concatenated are plain text.
+def shard_name(file_parameters, index):
+    if file_parameters.keep_shard_files:
+        return insert_suffix(file_parameters.output_file, '.%03d' % index)
+    return '%s.%03d' % (file_parameters.output_file, index)
+
+# Opens the sorted file at the offset a shard starts reading from
+@contextlib.contextmanager
+def open_shard_input(file_parameters, shard):
+    with open((file_parameters.input_file if file_parameters.pre_sorted else file_parameters.sorted_file),'rb',64*1024) as input_:
+        input_.seek(shard.offset)
+        yield input_
+
+# Shard files are written with the output options only if they are kept, otherwise as text to be concatenated
+def shard_output_options(process_parameters, file_parameters):
+    return output_options(process_parameters, file_parameters) if file_parameters.keep_shard_files else dict()
+
+# Generates a benchmark in time shards, each one in its own worker process, and concatenates the shard outputs into the
+# output file unless they should be kept as separate files. generate_shard is the shard generator of the benchmark
+# variant, warm_records the number of preceding records its read buffers need.
+def generate_sharded(generate_shard, warm_records, process_parameters, benchmark_parameters, file_parameters):
+    dataset_info = extractInfo(process_parameters, file_parameters)
+    plan = plan_shards(benchmark_parameters, file_parameters, dataset_info, warm_records)
+
+    pool = multiprocessing.Pool(len(plan))
+    try:
+        # Progress is measured in finished shards
+        with stats.stage('generation', len(plan)) as progress:
+            arguments = [(process_parameters, benchmark_parameters, file_parameters, dataset_info, shard) for shard in plan]
+            for finished, (commands, bytes_, counters) in enumerate(pool.imap_unordered(generate_shard, arguments), 1):
+                stats.add_counters(counters)
+                progress.update(commands, bytes_, finished)
+        pool.close()
+    except:
+        pool.terminate()
+        raise
+    finally:
+        pool.join()
+
+    if file_parameters.keep_shard_files:
+        return
+
+    with open_output(file_parameters.output_file, **output_options(process_parameters, file_parameters)) as w:
+        lines_left = benchmark_parameters.output_limit
+        for shard in plan:
+            with open_read(shard.output_file) as r:
+                if lines_left == float('inf'):
+                    shutil.copyfileobj(r, w, 1024*1024)
+                else:
+                    for line in itertools.islice(r, int(lines_left)):
+                        w.write(line)
+                        lines_left -= 1
+            os.remove(shard.output_file)
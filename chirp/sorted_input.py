@@ -0,0 +1,74 @@
+#!/usr/bin/env python
+#coding: utf-8
+
+import contextlib, bisect
+from dataset_stats import read_sidecar, index_file
+from compression import open_read, is_compressed
+from record_fields import field_extractor
+
+
+# Path of the sorted file benchmark generation reads
+def sorted_file_name(file_parameters):
+    return file_parameters.input_file if file_parameters.pre_sorted else file_parameters.sorted_file
+
+# Extracts information about the JSON file that has been sorted by the timestamp field. The information is read from
+# the metadata sidecar of the file if there is an up to date one, otherwise the file is indexed in a single pass.
+def extractInfo(process_parameters, file_parameters):
+    input_ = sorted_file_name(file_parameters)
+
+    info = read_sidecar(input_)
+    if info is None:
+        info = index_file(process_parameters, input_)
+    return info
+
+
+# Opens the input of benchmark generation and yields information about it along with an iterator over its lines. The
+# input is either the sorted file, read from the given offset on, or, when sorting and generation are fused, the final
+# merge pass of the sorted runs.
+@contextlib.contextmanager
+def open_sorted_input(process_parameters, file_parameters, sorted_runs=None, offset=0):
+    if sorted_runs is not None:
+        yield sorted_runs.info, iter(sorted_runs)
+    else:
+        with open_read(sorted_file_name(file_parameters),1) as input_:
+            if offset:
+                input_.seek(offset)
+            yield extractInfo(process_parameters, file_parameters), input_
+
+
+# Yields the timestamps of the records of a sorted file relative to zero_time, from about the given relative time on.
+# Reading starts at the last time index entry before that time, unless the file is compressed and cannot seek.
+def sorted_timestamps(process_parameters, sorted_file, time_index, zero_time, start=0):
+    extract_time = field_extractor([process_parameters.time_field])
+    entry = bisect.bisect_left(time_index, (zero_time + start,)) - 1
+    with open_read(sorted_file) as input_:
+        if entry >= 0 and not is_compressed(sorted_file):
+            input_.seek(time_index[entry][1])
+        for line in input_:
+            try:
+                yield extract_time(line)[0] - zero_time
+            except (ValueError, KeyError):
+                pass # generation counts the skipped lines
+
+
+class OffsetLines():
+    '''Iterates over the stripped lines of the sorted input, keeping the byte offset of the line last returned and of the
+    line after it, so that generation can checkpoint its position in the input.'''
+
+    def __init__(self, input_, offset=0):
+        '''Initialize state variables.'''
+
+        self._lines = iter(input_)
+        self.line_offset = offset
+        self.offset = offset
+
+
+    def __iter__(self):
+        return self
+
+
+    def next(self):
+        line = self._lines.next()
+        self.line_offset = self.offset
+        self.offset += len(line)
+        return line.strip()
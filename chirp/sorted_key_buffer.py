@@ -0,0 +1,140 @@
+#!/usr/bin/env python
+#coding: utf-8
+
+import bisect, collections
+
+
+class SortedKeyBuffer():
+    '''A sorted buffer of keys that allows picking keys by their rank in sort order. Keys are kept in sorted blocks whose
+    lengths are indexed by a Fenwick tree, which gives O(logN) performance for inserts and indexed reads where N is the
+    number of keys, plus an amortized block split or merge. If the buffer is bounded, inserting into a full buffer evicts
+    the key that was inserted first, so the buffer holds a sliding window of the most recent keys.'''
+
+    def __init__(self, size=None, load=1000):
+        '''Initialize storage structures and state variables.'''
+
+        self._blocks = list()
+        self._maxes = list()
+        self._tree = list()
+        self._len = 0
+
+        self._size = size
+        self._load = load
+        self._history = collections.deque() if size else None
+
+
+    def insert(self, item):
+        '''Insert an item into the buffer, evicting the oldest item if the buffer is bounded and full.'''
+
+        if self._size:
+            self._history.append(item)
+            if self._len == self._size:
+                self._remove(self._history.popleft())
+
+        if not self._blocks:
+            self._blocks.append([item])
+            self._maxes.append(item)
+            self._rebuildTree()
+            self._len = 1
+            return
+
+        index = bisect.bisect_right(self._maxes, item)
+        if index == len(self._blocks):
+            index -= 1
+            self._blocks[index].append(item)
+            self._maxes[index] = item
+        else:
+            bisect.insort(self._blocks[index], item)
+        self._len += 1
+
+        if len(self._blocks[index]) > 2*self._load:
+            # Split overlong blocks in half
+            block = self._blocks[index]
+            self._blocks[index:index+1] = [block[:self._load], block[self._load:]]
+            self._maxes[index:index+1] = [block[self._load-1], block[-1]]
+            self._rebuildTree()
+        else:
+            self._addToTree(index, 1)
+
+
+    def _remove(self, item):
+        '''Remove one occurrence of an item from the buffer.'''
+
+        index = bisect.bisect_left(self._maxes, item)
+        block = self._blocks[index]
+        del block[bisect.bisect_left(block, item)]
+        self._len -= 1
+
+        if not block:
+            del self._blocks[index]
+            del self._maxes[index]
+            self._rebuildTree()
+        elif len(block) < self._load/4 and len(self._blocks) > 1:
+            # Merge short blocks into a neighbour, and split again if that made the neighbour overlong
+            neighbour = index - 1 if index else index + 1
+            first, last = min(index, neighbour), max(index, neighbour)
+            merged = self._blocks[first] + self._blocks[last]
+            if len(merged) > 2*self._load:
+                self._blocks[first:last+1] = [merged[:self._load], merged[self._load:]]
+                self._maxes[first:last+1] = [merged[self._load-1], merged[-1]]
+            else:
+                self._blocks[first:last+1] = [merged]
+                self._maxes[first:last+1] = [merged[-1]]
+            self._rebuildTree()
+        else:
+            self._maxes[index] = block[-1]
+            self._addToTree(index, -1)
+
+
+    def _rebuildTree(self):
+        '''Rebuild the Fenwick tree over block lengths in O(B) time, where B is the number of blocks.'''
+
+        tree = [len(block) for block in self._blocks]
+        blocks = len(tree)
+        for index in xrange(blocks):
+            parent = index | (index + 1)
+            if parent < blocks:
+                tree[parent] += tree[index]
+        self._tree = tree
+
+        self._top = 1
+        while self._top*2 <= blocks:
+            self._top *= 2
+
+
+    def _addToTree(self, index, delta):
+        '''Add delta to the length of a block.'''
+
+        tree = self._tree
+        blocks = len(tree)
+        while index < blocks:
+            tree[index] += delta
+            index |= index + 1
+
+
+    def __len__(self):
+        '''Number of keys in the buffer.'''
+
+        return self._len
+
+
+    def __getitem__(self, index):
+        '''Item-getter for reads by rank in sort order. Negative indices count from the end.'''
+
+        if index < 0:
+            index += self._len
+        if not 0 <= index < self._len:
+            raise IndexError('SortedKeyBuffer index out of range')
+
+        # Descend the Fenwick tree to find the block holding the item and the item's offset inside it
+        tree = self._tree
+        blocks = len(tree)
+        position = 0
+        step = self._top
+        while step:
+            if position + step <= blocks and tree[position + step - 1] <= index:
+                position += step
+                index -= tree[position - 1]
+            step >>= 1
+
+        return self._blocks[position][index]
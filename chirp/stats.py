@@ -0,0 +1,186 @@
+#!/usr/bin/env python
+#coding: utf-8
+
+import sys, time, cProfile, pstats, collections, contextlib
+from commons import ujson
+
+
+# Stages of a run, in order
+STAGES = ('chunk-sort', 'merge-pass', 'merge', 'generation')
+
+# Run statistics. When enabled with --stats, every stage of a run reports its progress through a StageProgress: records
+# and bytes per second, and an ETA if the stage knows its total, printed to standard error every REPORT_INTERVAL seconds.
+# Stages and counters end up in a JSON summary. One stage can be run under cProfile. When statistics are disabled,
+# stages get a no-op Progress, so instrumented code does not need to check.
+REPORT_INTERVAL = 5.0
+
+_run = None
+
+
+class Progress():
+    '''No-op progress of a stage, used when statistics are disabled.'''
+
+    def update(self, records, bytes_=0, position=None):
+        pass
+
+
+    def wrap(self, iterable, size=len, every=65536):
+        return iterable
+
+
+class StageProgress(Progress):
+    '''Progress of a stage. The stage is done when its position reaches the total. Without explicit positions, the
+    number of records is the position.'''
+
+    def __init__(self, name, total=None, out=sys.stderr):
+        '''Initialize counters.'''
+
+        self.name = name
+        self.total = total
+        self.records = 0
+        self.bytes = 0
+        self.position = None
+        self._out = out
+        self._start = time.time()
+        self._last_report = self._start
+        self.seconds = None
+
+
+    def update(self, records, bytes_=0, position=None):
+        '''Add records and bytes processed and report if the last report is long enough ago.'''
+
+        self.records += records
+        self.bytes += bytes_
+        if position is not None:
+            self.position = position
+        now = time.time()
+        if now - self._last_report >= REPORT_INTERVAL:
+            self._last_report = now
+            self._report(now)
+
+
+    def wrap(self, iterable, size=len, every=65536):
+        '''Iterate over records, updating progress every so many records with the sizes of the records.'''
+
+        records = 0
+        bytes_ = 0
+        for item in iterable:
+            records += 1
+            bytes_ += size(item)
+            if records == every:
+                self.update(records, bytes_)
+                records = bytes_ = 0
+            yield item
+        self.update(records, bytes_)
+
+
+    def _report(self, now):
+        '''Print a progress line.'''
+
+        elapsed = now - self._start
+        line = '%s: %d records, %.0f records/s, %.1f MB/s' % (self.name, self.records, self.records / elapsed,
+                                                              self.bytes / elapsed / 1e6)
+        position = self.records if self.position is None else self.position
+        if self.total and position:
+            fraction = min(float(position) / self.total, 1.0)
+            eta = int(elapsed * (1 - fraction) / fraction)
+            line += ', %.1f%% done, ETA %d:%02d:%02d' % (100 * fraction, eta // 3600, eta // 60 % 60, eta % 60)
+        self._out.write(line + '\n')
+
+
+    def finish(self):
+        '''Stop the clock and print a final line.'''
+
+        self.seconds = time.time() - self._start
+        self._out.write('%s: %d records in %.1f s\n' % (self.name, self.records, self.seconds))
+
+
+    def summary(self):
+        '''Throughput of the stage as a dictionary.'''
+
+        return {'records': self.records,
+                'bytes': self.bytes,
+                'seconds': self.seconds,
+                'records_per_second': self.records / self.seconds if self.seconds else None,
+                'bytes_per_second': self.bytes / self.seconds if self.seconds else None}
+
+
+class RunStats():
+    '''Statistics of a run: finished stages, counters and profiles.'''
+
+    def __init__(self, profile_stage=None):
+        '''Initialize storage structures.'''
+
+        self.start = time.time()
+        self.stages = collections.OrderedDict()
+        self.counters = collections.defaultdict(int)
+        self.profile_stage = profile_stage
+        self.profiles = dict()
+
+
+def enable(profile_stage=None):
+    global _run
+    _run = RunStats(profile_stage)
+
+# Runs a stage, yielding its progress. A stage that is entered several times accumulates its records, bytes and time.
+@contextlib.contextmanager
+def stage(name, total=None):
+    if _run is None:
+        yield Progress()
+        return
+
+    progress = StageProgress(name, total)
+    profile = cProfile.Profile() if name == _run.profile_stage else None
+    if profile is not None:
+        profile.enable()
+    try:
+        yield progress
+    finally:
+        if profile is not None:
+            profile.disable()
+            _run.profiles.setdefault(name, []).append(profile)
+        progress.finish()
+        summary = progress.summary()
+        if name in _run.stages:
+            for key in ('records', 'bytes', 'seconds'):
+                summary[key] += _run.stages[name][key]
+            summary['records_per_second'] = summary['records'] / summary['seconds'] if summary['seconds'] else None
+            summary['bytes_per_second'] = summary['bytes'] / summary['seconds'] if summary['seconds'] else None
+        _run.stages[name] = summary
+
+def count(name, amount=1):
+    if _run is not None:
+        _run.counters[name] += amount
+
+# Returns the counters of this process and resets them. Worker processes forked from the main process inherit its
+# counters, so they take them once when they start and hand what they counted back when they finish.
+def take_counters():
+    if _run is None:
+        return dict()
+    counters = dict(_run.counters)
+    _run.counters.clear()
+    return counters
+
+def add_counters(counters):
+    for name, amount in counters.iteritems():
+        count(name, amount)
+
+# Writes the JSON summary of the run, and the profile of the profiled stage next to it, printing its top functions
+def write_summary(stats_file, out=sys.stderr):
+    if _run is None:
+        return
+
+    summary = {'seconds': time.time() - _run.start,
+               'stages': _run.stages,
+               'counters': dict(_run.counters)}
+    for name, profiles in _run.profiles.iteritems():
+        profile_file = '%s.%s.prof' % (stats_file, name)
+        profile_stats = pstats.Stats(*profiles, stream=out)
+        profile_stats.dump_stats(profile_file)
+        profile_stats.sort_stats('cumulative').print_stats(20)
+        summary.setdefault('profiles', dict())[name] = profile_file
+
+    for name, counter in sorted(_run.counters.iteritems()):
+        out.write('%s: %d\n' % (name.replace('_', ' '), counter))
+    with open(stats_file, 'w') as w:
+        w.write(ujson.dumps(summary))
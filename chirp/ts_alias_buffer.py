@@ -0,0 +1,214 @@
+#!/usr/bin/env python
+#coding: utf-8
+
+import random, math, bisect, collections
+
+
+def alias_table(weights):
+    '''Builds the probability and alias columns of Vose's alias method for a list of weights, the largest of which must
+    be positive.'''
+
+    n = len(weights)
+    total = sum(weights)
+    scaled = [weight * n / total for weight in weights]
+    prob = [1.0] * n
+    alias = range(n)
+
+    small = [index for index in xrange(n) if scaled[index] < 1.0]
+    large = [index for index in xrange(n) if scaled[index] >= 1.0]
+    while small and large:
+        less = small.pop()
+        more = large.pop()
+        prob[less] = scaled[less]
+        alias[less] = more
+        scaled[more] += scaled[less] - 1.0
+        if scaled[more] < 1.0:
+            small.append(more)
+        else:
+            large.append(more)
+
+    return prob, alias
+
+def alias_pick(prob, alias, fraction):
+    '''Picks a column of an alias table with a fraction between 0 and 1. Returns the column along with a fresh fraction,
+    derived from the bits of the given one that were not used, for further picks.'''
+
+    position = fraction * len(prob)
+    column = min(int(position), len(prob) - 1)
+    coin = position - column
+    if coin < prob[column]:
+        return column, coin / prob[column]
+    return alias[column], (coin - prob[column]) / (1.0 - prob[column])
+
+
+class TSAliasBuffer():
+    '''A buffer that stores the N most recent items and associated relative log-likelihood of reads on them, like
+    TSCircularBuffer, and picks random items in O(1) time with the alias method. Items are grouped in blocks of about
+    sqrt(N) consecutive inserts. Every full block gets an alias table over its items and a top-level alias table picks
+    the block, so both tables are rebuilt once per block, which gives O(1) amortized performance on inserts. Items of the
+    block being filled are picked by binary search over their cumulative weights, and so are the items of the oldest
+    block, whose items leave the buffer one by one as new ones arrive.'''
+
+    # Largest log-likelihood above the reference of the block being filled before its weights are rebased
+    _MAX_EXPONENT = 512.0
+    _MIN_BLOCK = 64
+
+    def __init__(self, size):
+        '''Initialize storage structures and state variables.'''
+
+        self._size = size
+        self._block_size = max(1, min(size, max(self._MIN_BLOCK, int(math.sqrt(size)))))
+        self._count = 0
+
+        # Full blocks hold (items, prob, alias, log_total, cumulative, top), where cumulative holds the cumulative
+        # weights of the items relative to exp(top). The top-level table picks among all full blocks but the oldest,
+        # of which only the items from self._oldest_start on are still in the buffer.
+        self._blocks = collections.deque()
+        self._oldest_start = 0
+        self._top = None
+        self._top_log_total = None
+
+        # The block being filled, with cumulative weights relative to exp(self._exp_zero)
+        self._items = []
+        self._log_probs = []
+        self._cumulative = []
+        self._exp_zero = None
+
+        # Shares of the total weight held by the block being filled and by the oldest block
+        self._partial_share = 1.0
+        self._oldest_share = 0.0
+
+
+    def insert(self, item, log_prob):
+        '''Insert an item into the buffer, evicting the oldest item and completing a block if needed.'''
+
+        if self._exp_zero is None:
+            self._exp_zero = log_prob
+        elif log_prob - self._exp_zero > self._MAX_EXPONENT:
+            self._rebase(log_prob)
+
+        weight = math.exp(log_prob - self._exp_zero)
+        self._items.append(item)
+        self._log_probs.append(log_prob)
+        self._cumulative.append(self._cumulative[-1] + weight if self._cumulative else weight)
+
+        if self._count == self._size:
+            self._evict()
+        else:
+            self._count += 1
+        if len(self._items) == self._block_size:
+            self._complete_block()
+        self._update_shares()
+
+
+    def _rebase(self, exp_zero):
+        '''Express the cumulative weights of the block being filled relative to a new reference log-likelihood.'''
+
+        self._cumulative = []
+        total = 0.0
+        for log_prob in self._log_probs:
+            total += math.exp(log_prob - exp_zero)
+            self._cumulative.append(total)
+        self._exp_zero = exp_zero
+
+
+    def _evict(self):
+        '''Drop the oldest item, and the oldest block along with it if it was its last item.'''
+
+        self._oldest_start += 1
+        if self._oldest_start == len(self._blocks[0][0]):
+            self._blocks.popleft()
+            self._oldest_start = 0
+            self._build_top()
+
+
+    def _complete_block(self):
+        '''Turn the block being filled into a full block with its own alias table and rebuild the top-level table.'''
+
+        top = max(self._log_probs)
+        weights = [math.exp(log_prob - top) for log_prob in self._log_probs]
+        prob, alias = alias_table(weights)
+        cumulative = []
+        total = 0.0
+        for weight in weights:
+            total += weight
+            cumulative.append(total)
+        self._blocks.append((self._items, prob, alias, top + math.log(total), cumulative, top))
+        self._build_top()
+
+        self._items = []
+        self._log_probs = []
+        self._cumulative = []
+        self._exp_zero = None
+
+
+    def _build_top(self):
+        '''Rebuild the top-level table over the full blocks but the oldest.'''
+
+        if len(self._blocks) < 2:
+            self._top = None
+            self._top_log_total = None
+            return
+
+        log_totals = [self._blocks[index][3] for index in xrange(1, len(self._blocks))]
+        top = max(log_totals)
+        weights = [math.exp(log_total - top) for log_total in log_totals]
+        self._top = alias_table(weights)
+        self._top_log_total = top + math.log(sum(weights))
+
+
+    def _update_shares(self):
+        '''Recompute the shares of the total weight held by the block being filled and by what is left of the oldest
+        block.'''
+
+        log_totals = [None, None, self._top_log_total]
+        if self._cumulative and self._cumulative[-1] > 0:
+            log_totals[0] = self._exp_zero + math.log(self._cumulative[-1])
+        if self._blocks:
+            items, prob, alias, log_total, cumulative, top = self._blocks[0]
+            live = cumulative[-1] - cumulative[self._oldest_start - 1] if self._oldest_start else cumulative[-1]
+            if live > 0:
+                log_totals[1] = top + math.log(live)
+
+        present = [log_total for log_total in log_totals if log_total is not None]
+        if not present:
+            self._partial_share = 1.0
+            self._oldest_share = 0.0
+            return
+        top = max(present)
+        weights = [math.exp(log_total - top) if log_total is not None else 0.0 for log_total in log_totals]
+        total = sum(weights)
+        self._partial_share = weights[0] / total
+        self._oldest_share = weights[1] / total
+
+
+    def rand(self):
+        '''Returns a random item from buffer based on probabilities derived from the log-likelihoods associated with items.'''
+
+        return self.sample(random.random())
+
+
+    def sample(self, fraction):
+        '''Returns the item at the given fraction, between 0 and 1, of the total cumulative probability. Passing uniformly
+        distributed fractions gives the same distribution as rand.'''
+
+        if fraction < self._partial_share:
+            if not self._items:
+                return None
+            threshold = fraction / self._partial_share * self._cumulative[-1]
+            return self._items[min(bisect.bisect_right(self._cumulative, threshold), len(self._items) - 1)]
+
+        fraction -= self._partial_share
+        if fraction < self._oldest_share or self._top is None:
+            if not self._blocks:
+                return None
+            items, prob, alias, log_total, cumulative, top = self._blocks[0]
+            dead = cumulative[self._oldest_start - 1] if self._oldest_start else 0.0
+            threshold = dead + min(fraction / self._oldest_share, 1.0) * (cumulative[-1] - dead) if self._oldest_share else dead
+            index = min(bisect.bisect_right(cumulative, threshold, self._oldest_start), len(items) - 1)
+            return items[index]
+
+        fraction = min((fraction - self._oldest_share) / (1.0 - self._partial_share - self._oldest_share), 1.0)
+        block, fraction = alias_pick(self._top[0], self._top[1], fraction)
+        items, prob, alias, log_total, cumulative, top = self._blocks[block + 1]
+        return items[alias_pick(prob, alias, fraction)[0]]
@@ -20,6 +20,7 @@ class TSCircularBuffer():
         self._rolled_over_once = False
         
         # These variables help guarantee performance without causing numerical overflow in probability values.
+        # Log-likelihoods are taken relative to self._exp_zero, the one of the first item until the first rollover.
         self._prob_zero = 0
         self._exp_zero = 0
     
@@ -36,9 +37,11 @@ class TSCircularBuffer():
         if self._rolled_over_once:
             self._cum_prob[self._cursor] = self._cum_prob[self._cursor-1] + math.exp(log_prob - self._exp_zero)
         elif self._cursor != 0:
-            self._cum_prob.append(self._cum_prob[self._cursor-1] + math.exp(log_prob))
+            self._cum_prob.append(self._cum_prob[self._cursor-1] + math.exp(log_prob - self._exp_zero))
         else:
-            self._cum_prob.append(math.exp(log_prob))
+            # Buffers filled from partway through a dataset, e.g. by a shard, start with large log-likelihoods
+            self._exp_zero = log_prob
+            self._cum_prob.append(1.0)
         
         self._cursor += 1
         if self._cursor == self._size:
@@ -53,9 +56,9 @@ class TSCircularBuffer():
         '''Adjust cumulative probability values based on the last-written item's log-likelihood. This periodic step
         ensures that probabilities will not blow up during long runs.'''
         
-        # Calculate the probability of the last-written item and set a new 'zero' value for future log-likelihoods.
+        # Calculate the probability of the last-written item and move the 'zero' value for future log-likelihoods to it.
         ratio = self._cum_prob[-1] - self._cum_prob[-2]
-        self._exp_zero = math.log(ratio)
+        self._exp_zero += math.log(ratio)
         
         # Divide existing cumulative probability values and their zero error by the probability of the last item.
         for index in xrange(self._size):
@@ -66,11 +69,18 @@ class TSCircularBuffer():
     def rand(self):
         '''Returns a random item from buffer based on probabilities derived from the log-likelihoods associated with items.'''
     
+        return self.sample(random.random())
+    
+    
+    def sample(self, fraction):
+        '''Returns the item at the given fraction, between 0 and 1, of the total cumulative probability. Passing uniformly
+        distributed fractions gives the same distribution as rand.'''
+    
         if not self._rolled_over_once and self._cursor == 0:
             return None
         
         # Calculate a cumulative probability threshold to search for taking into account the zero error
-        threshold = random.random() * (self._cum_prob[self._cursor - 1] - self._prob_zero) + self._prob_zero
+        threshold = fraction * (self._cum_prob[self._cursor - 1] - self._prob_zero) + self._prob_zero
         
         return self._thresholdItem(threshold)
     
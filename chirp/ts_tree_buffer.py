@@ -0,0 +1,109 @@
+#!/usr/bin/env python
+#coding: utf-8
+
+import random, math
+
+
+class TSTreeBuffer():
+    '''A circular buffer that stores items and associated relative log-likelihood of reads on them, like TSCircularBuffer.
+    Item weights are kept in the leaves of a segment tree whose inner nodes hold the sums of their children, which gives
+    O(logN) performance for both inserts and random reads where N is the size of the buffer. Inner sums are recomputed
+    from their children on every update instead of being adjusted by differences, so rounding errors do not accumulate.'''
+
+    # Largest log-likelihood above the current reference before weights are rebased, well within the range of a float.
+    _MAX_EXPONENT = 512.0
+
+    def __init__(self, size):
+        '''Initialize storage structures and state variables.'''
+
+        self._data = dict()
+        self._log_prob = [None] * size
+
+        self._size = size
+        self._leaves = 1
+        while self._leaves < size:
+            self._leaves *= 2
+        self._tree = [0.0] * (2*self._leaves)
+
+        self._cursor = 0
+        self._count = 0
+        self._exp_zero = None
+
+
+    def insert(self, item, log_prob):
+        '''Insert an item into the buffer, overwriting the oldest item once the buffer is full.'''
+
+        if self._exp_zero is None:
+            self._exp_zero = log_prob
+        elif log_prob - self._exp_zero > self._MAX_EXPONENT:
+            self._rebase(log_prob)
+
+        self._data[self._cursor] = item
+        self._log_prob[self._cursor] = log_prob
+        self._update(self._cursor, math.exp(log_prob - self._exp_zero))
+
+        self._cursor += 1
+        if self._cursor == self._size:
+            self._cursor = 0
+        if self._count < self._size:
+            self._count += 1
+
+
+    def _update(self, index, weight):
+        '''Set the weight of a leaf and recompute the sums on its path to the root.'''
+
+        tree = self._tree
+        node = index + self._leaves
+        tree[node] = weight
+        node >>= 1
+        while node:
+            tree[node] = tree[2*node] + tree[2*node + 1]
+            node >>= 1
+
+
+    def _rebase(self, exp_zero):
+        '''Express all weights relative to a new reference log-likelihood. Weights only grow over time in a benchmark, so
+        this happens once every _MAX_EXPONENT units of log-likelihood rather than on every rollover of the buffer.'''
+
+        self._exp_zero = exp_zero
+        tree = self._tree
+        for index in xrange(self._count):
+            tree[index + self._leaves] = math.exp(self._log_prob[index] - exp_zero)
+        for node in xrange(self._leaves - 1, 0, -1):
+            tree[node] = tree[2*node] + tree[2*node + 1]
+
+
+    def rand(self):
+        '''Returns a random item from buffer based on probabilities derived from the log-likelihoods associated with items.'''
+
+        return self.sample(random.random())
+
+
+    def sample(self, fraction):
+        '''Returns the item at the given fraction, between 0 and 1, of the total cumulative probability.'''
+
+        if not self._count:
+            return None
+
+        return self._thresholdItem(fraction * self._tree[1])
+
+
+    def _thresholdItem(self, threshold):
+        '''Descends the tree to find the item such that threshold lies in the cumulative probability range specified by
+        the item. Empty right subtrees are never entered, even if rounding pushes the threshold past the total weight.'''
+
+        tree = self._tree
+        node = 1
+        while node < self._leaves:
+            node *= 2
+            if threshold >= tree[node] and tree[node + 1] > 0:
+                threshold -= tree[node]
+                node += 1
+
+        return self._data[node - self._leaves]
+
+
+    def __getitem__(self, index):
+        '''Item-getter for indexed reads.'''
+
+        return self._data[index % self._size]
@@ -1,21 +1,53 @@
 #!/usr/bin/env python
 #coding: utf-8
 
-import os
+import os, sys
 from chirp import *
 
 if __name__ == '__main__':
 
+    # ./run_chirp.py replay ... replays a benchmark file against a store instead of generating one
+    if sys.argv[1:2] == ['replay']:
+        replay.replay(options_parser.parse_replay_args(sys.argv[2:]))
+        sys.exit(0)
+
+    # ./run_chirp.py convert ... converts a benchmark file between the text and binary formats
+    if sys.argv[1:2] == ['convert']:
+        binary_format.convert(*options_parser.parse_convert_args(sys.argv[2:]))
+        sys.exit(0)
+
     process_parameters, benchmark_parameters, file_parameters = options_parser.parse_args()
+    if process_parameters.stats_file:
+        stats.enable(process_parameters.profile_stage)
     
-    if not file_parameters.pre_sorted:
+    # Resumed and extended runs continue from the checkpoint of the output file
+    resume_state = None
+    if file_parameters.resume or file_parameters.extend:
+        resume_state = checkpoint.load_checkpoint(file_parameters.output_file, process_parameters, benchmark_parameters)
+
+    sorted_runs = None
+    if file_parameters.extend:
+        # New records are merged into the sorted file, which generation then continues on
+        resume_state['input_offset'] = external_sort.extend_sorted(process_parameters, file_parameters, resume_state['input_offset'])[0]
+        file_parameters = file_parameters._replace(pre_sorted = False)
+    elif file_parameters.stream_sorted:
+        sorted_runs = external_sort.sort_runs(process_parameters, file_parameters)
+    elif not file_parameters.pre_sorted and not file_parameters.resume:
         external_sort.batch_sort(process_parameters, file_parameters)
     
-    if benchmark_parameters.read_range_width == 1:
-        benchmark.generate_benchmark(process_parameters, benchmark_parameters, file_parameters)
-    else:
-        rr_benchmark.generate_benchmark(process_parameters, benchmark_parameters, file_parameters)
+    try:
+        if benchmark_parameters.read_range_width == 1:
+            benchmark.generate_benchmark(process_parameters, benchmark_parameters, file_parameters, sorted_runs, resume_state)
+        else:
+            rr_benchmark.generate_benchmark(process_parameters, benchmark_parameters, file_parameters, sorted_runs, resume_state)
+    finally:
+        if sorted_runs is not None:
+            sorted_runs.close()
 
-    if not file_parameters.pre_sorted and not file_parameters.keep_sorted_file:
+    if not file_parameters.pre_sorted and not file_parameters.stream_sorted and not file_parameters.keep_sorted_file:
         os.remove(file_parameters.sorted_file)
+        if os.path.exists(dataset_stats.sidecar_name(file_parameters.sorted_file)):
+            os.remove(dataset_stats.sidecar_name(file_parameters.sorted_file))
 
+    if process_parameters.stats_file:
+        stats.write_summary(process_parameters.stats_file)